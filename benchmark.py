@@ -0,0 +1,516 @@
+'''
+Offline benchmarks of COVID-19 Data Factory components
+
+Pipeline stages are fed with fixture payloads through a pluggable transport, no network is used.
+Payloads recorded from the live sources (python benchmark.py --record) are taken from fixtures/ directory,
+otherwise synthetic payloads of the same layout are generated
+
+Usage:
+python benchmark.py resolver
+python benchmark.py pipeline --scale 1 10 100 --output results.json --compare previous.json
+'''
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import subprocess
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import main
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+MANUAL_FIXTURE_URL = 'https://docs.google.com/spreadsheets/d/e/FIXTURE/pub?output=csv'
+
+CSSE_HEADER = ['FIPS', 'Admin2', 'Province_State', 'Country_Region', 'Last_Update', 'Lat', 'Long_',
+               'Confirmed', 'Deaths', 'Recovered', 'Active', 'Combined_Key', 'Incident_Rate', 'Case_Fatality_Ratio']
+
+
+def timed(func, repeat=5):
+    '''
+    Return the best wall time of repeat calls (in seconds)
+    '''
+    best = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def measured(func):
+    '''
+    Run func once under tracemalloc
+    Return (peak traced memory in bytes, number of memory blocks still allocated after the call)
+    '''
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    blocks = sys.getallocatedblocks() - blocks
+    del result
+
+    return peak, blocks
+
+
+class FixtureTransport(object):
+    '''
+    requests.Session compatible transport serving fixture payloads by URL
+    '''
+
+    def __init__(self, fixtures, max_record_count=2000):
+
+        self.fixtures = fixtures
+        self.max_record_count = max_record_count
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+
+        self.requests += 1
+
+        if 'arcgis' in url and not urlparse(url).path.endswith('/query'):
+            body = json.dumps({'maxRecordCount': self.max_record_count}).encode('utf-8')
+        elif 'arcgis' in url:
+            body = self.arcgis(parse_qs(urlparse(url).query))
+        elif 'csse_covid_19_daily_reports' in url:
+            body = self.fixtures['csse']
+        elif 'worldometers' in url:
+            body = self.fixtures['worldometer']
+        elif url == MANUAL_FIXTURE_URL:
+            body = self.fixtures['manual']
+        else:
+            return self.response(404, b'')
+
+        self.bytes += len(body)
+        return self.response(200, body)
+
+    def arcgis(self, query):
+
+        features = self.fixtures['arcgis']['features']
+
+        if query.get('returnCountOnly'):
+            return json.dumps({'count': len(features)}).encode('utf-8')
+
+        offset = int(query['resultOffset'][0])
+        size = min(int(query['resultRecordCount'][0]), self.max_record_count)
+
+        page = dict(self.fixtures['arcgis'])
+        page['features'] = features[offset:offset + size]
+        page['exceededTransferLimit'] = size < int(query['resultRecordCount'][0]) and offset + size < len(features)
+
+        return json.dumps(page).encode('utf-8')
+
+    def response(self, status, body):
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(
+            {'Content-Length': str(len(body))})
+        response.encoding = 'utf-8'
+        response._content = body
+        response._content_consumed = True
+        response.url = ''
+
+        return response
+
+
+def record_fixtures():
+    '''
+    Record live payloads of all the sources into FIXTURES_DIR
+    '''
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+
+    factory = main.CovidDataFactory()
+    http = factory.http
+
+    count = http.get(factory.arcgis_query_url(
+        returnCountOnly='true'), timeout=120).json()['count']
+    features = []
+    for offset in range(0, count, main.ARCGIS_PAGE_SIZE):
+        page = http.get(factory.arcgis_query_url(
+            resultOffset=offset, resultRecordCount=main.ARCGIS_PAGE_SIZE), timeout=120).json()
+        features += page['features']
+    page['features'] = features
+
+    yesterday = datetime.utcnow().date().toordinal() - 1
+    sources = {
+        'arcgis.json': json.dumps(page).encode('utf-8'),
+        'csse.csv': http.get('https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_daily_reports/{0}.csv'.format(
+            datetime.fromordinal(yesterday).strftime('%m-%d-%Y')), timeout=40).content,
+        'worldometer.html': http.get('https://www.worldometers.info/coronavirus/', timeout=40).content,
+    }
+
+    if main.MANUAL_DATA_SOURCE_URL:
+        sources['manual.csv'] = http.get(
+            main.MANUAL_DATA_SOURCE_URL, timeout=40).content
+
+    for name, body in sources.items():
+        with open(os.path.join(FIXTURES_DIR, name), 'wb') as f:
+            f.write(body)
+        print('Recorded', name, len(body), 'bytes')
+
+
+def synthetic_fixtures(seed=2020):
+    '''
+    Generate payloads with the layout of every source (CSSE daily report of a sub-national size)
+    '''
+    rnd = random.Random(seed)
+    titles = list(main.COUNTRIES.values()) + ['US', 'Korea, South', 'Taiwan*', 'Czechia', 'Burma', 'Unknown Land']
+    updated = 1588377148000
+
+    features = [{'attributes': {'OBJECTID': i + 1, 'Country_Region': title, 'Last_Update': updated,
+                                'Confirmed': rnd.randint(1000, 900000), 'Deaths': rnd.randint(0, 900),
+                                'Recovered': rnd.randint(0, 900)}} for i, title in enumerate(titles)]
+    arcgis = {'objectIdFieldName': 'OBJECTID', 'geometryType': 'esriGeometryPoint',
+              'fields': [{'name': name} for name in main.ARCGIS_FIELDS], 'features': features}
+
+    rows = []
+    for title in titles:
+        provinces = 3300 if title == 'US' else rnd.choice((1, 1, 1, 3, 10, 30))
+        for i in range(provinces):
+            confirmed = rnd.randint(0, 9000)
+            rows.append(['', 'County {0}'.format(i) if title == 'US' else '', 'Province {0}'.format(i % 50) if provinces > 1 else '',
+                         title, '2020-05-01 02:32:28', '1.0', '2.0', confirmed, confirmed // 20, confirmed // 3,
+                         confirmed - confirmed // 20 - confirmed // 3, title, '10.5', '2.1'])
+
+    page = ['<!DOCTYPE html><html><head><title>COVID-19</title>']
+    page += ['<script>var data{0} = "{1}";</script>'.format(i, 'x' * 200) for i in range(2000)]
+    page.append('</head><body><div class="nav">' + '<a href="#">link</a>' * 5000 + '</div>')
+    page.append('<table id="main_table_countries_today"><thead><tr>' + '<th>Column</th>' * 15 + '</tr></thead><tbody>')
+    for title in titles:
+        page.append('<tr style=""><td style="font-weight: bold;"><a class="mt_a" href="country/x/">{0}</a></td><td>{1:,}</td><td>+{2}</td><td>{3:,}</td><td></td><td>{4:,}</td>{5}</tr>\n'.format(
+            title, rnd.randint(1000, 900000), rnd.randint(0, 99), rnd.randint(0, 900), rnd.randint(0, 900), '<td>1</td>' * 9))
+    page.append('</tbody><tbody class="total_row_body"><tr><td>Total:</td></tr></tbody></table>')
+    page += ['<p>footer {0}</p>'.format(i) for i in range(5000)]
+    page.append('</body></html>')
+
+    manual = ['Country Title,Confirmed Cases,Deaths,Recovered,Source,Latest Update']
+    for title in rnd.sample(titles, 10):
+        manual.append('{0},{1},{2},{3},Manual,2020-05-01 10:00:00'.format(
+            json.dumps(title) if ',' in title else title, rnd.randint(1000, 9000), rnd.randint(0, 90), rnd.randint(0, 90)))
+
+    return {
+        'arcgis': arcgis,
+        'csse_header': CSSE_HEADER,
+        'csse_rows': rows,
+        'worldometer': ''.join(page).encode('utf-8'),
+        'manual': ('\n'.join(manual) + '\n').encode('utf-8'),
+    }
+
+
+def load_fixtures():
+    '''
+    Return recorded fixtures if present, otherwise synthetic ones
+    '''
+    fixtures = synthetic_fixtures()
+    recorded = []
+
+    def path(name):
+        return os.path.join(FIXTURES_DIR, name)
+
+    if os.path.exists(path('arcgis.json')):
+        with open(path('arcgis.json'), 'rb') as f:
+            fixtures['arcgis'] = json.load(f)
+        recorded.append('arcgis')
+
+    if os.path.exists(path('csse.csv')):
+        with open(path('csse.csv'), encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            fixtures['csse_header'] = next(reader)
+            fixtures['csse_rows'] = list(reader)
+        recorded.append('csse')
+
+    for name, filename in (('worldometer', 'worldometer.html'), ('manual', 'manual.csv')):
+        if os.path.exists(path(filename)):
+            with open(path(filename), 'rb') as f:
+                fixtures[name] = f.read()
+            recorded.append(name)
+
+    fixtures['recorded'] = recorded
+
+    return fixtures
+
+
+def scale_fixtures(fixtures, scale):
+    '''
+    Scale up number of rows of every source by the factor
+    '''
+    csse = io.StringIO()
+    writer = csv.writer(csse, lineterminator='\n')
+    writer.writerow(fixtures['csse_header'])
+    for _ in range(scale):
+        writer.writerows(fixtures['csse_rows'])
+
+    arcgis = dict(fixtures['arcgis'])
+    arcgis['features'] = fixtures['arcgis']['features'] * scale
+
+    page = fixtures['worldometer']
+    start = page.find(b'<tbody>') + len(b'<tbody>')
+    end = page.find(b'</tbody>', start)
+    worldometer = page[:start] + page[start:end] * scale + page[end:]
+
+    manual = fixtures['manual'].split(b'\n', 1)
+    manual = manual[0] + b'\n' + manual[1] * scale
+
+    return {
+        'arcgis': arcgis,
+        'csse': csse.getvalue().encode('utf-8'),
+        'worldometer': worldometer,
+        'manual': manual,
+    }
+
+
+def benchmark_stages(fixtures, repeat=3):
+    '''
+    Measure every pipeline stage fed by the fixtures
+    Return {stage: {'wall': seconds, 'peak': bytes, 'blocks': allocated blocks, 'items': result size}}
+    '''
+    main.MANUAL_DATA_SOURCE_URL = MANUAL_FIXTURE_URL
+
+    # Local state of the factory is kept in a scratch directory,
+    # so the benchmark neither reads nor alters the state of real runs
+    state_dir = tempfile.mkdtemp(prefix='covid-19-benchmark-')
+    state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+    main.PUBLISH_STATE_DIR = os.path.join(state_dir, 'publish')
+    main.SOURCE_STORE_PATH = os.path.join(state_dir, 'sources.db')
+    main.FETCH_CACHE_DIR = os.path.join(state_dir, 'cache')
+
+    try:
+        return run_stages(fixtures, repeat)
+    finally:
+        main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def run_stages(fixtures, repeat):
+
+    transport = FixtureTransport(fixtures)
+    factory = main.CovidDataFactory(transport=transport)
+    factory.cache = None
+
+    sources = {}
+
+    def worldometer(parser):
+        def read():
+            main.WORLDOMETER_PARSER = parser
+            try:
+                return factory.read_worldometer()
+            finally:
+                main.WORLDOMETER_PARSER = 'stream'
+        return read
+
+    def combine():
+        factory.combine_data(sources)
+        return factory.covid_data
+
+    def validate():
+        # A validator that has accepted the snapshot once sees no changed countries,
+        # every call starts from a fresh one to validate the whole snapshot
+        factory.validator = main.SnapshotValidator()
+        return factory.validate_json()
+
+    def serialize():
+        body, body_hash = main.serialize_snapshot(factory.covid_data)
+        return main.render_artifacts(factory.covid_data, body, main.snapshot_delta(None, factory.covid_data, None, body_hash))
+
+    stages = [
+        ('read_arcgis', 'arcgis', factory.read_arcgis),
+        ('read_covid_csse', 'csse', factory.read_covid_csse),
+        ('read_worldometer', 'worldometer', worldometer('stream')),
+        ('read_worldometer_soup', None, worldometer('soup')),
+        ('read_manual_data', 'manual', factory.read_manual_data),
+        ('combine_data', None, combine),
+        ('validate_json', None, validate),
+        ('serialize', None, serialize),
+    ]
+
+    results = {}
+
+    for name, source, func in stages:
+        if name == 'read_worldometer_soup':
+            try:
+                import bs4
+            except ImportError:
+                continue
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+            if source:
+                sources[source] = result
+
+            wall = timed(func, repeat)
+            peak, blocks = measured(func)
+
+        main.RESOLVER.misses.clear()
+
+        results[name] = {
+            'wall': wall,
+            'peak': peak,
+            'blocks': blocks,
+            'items': len(result) if hasattr(result, '__len__') else None,
+        }
+
+    return results
+
+
+def git_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_pipeline(scales=(1, 10, 100), repeat=3):
+    '''
+    Per-stage wall time, peak memory and allocations of the pipeline on fixture payloads scaled up by each factor
+    '''
+    fixtures = load_fixtures()
+    print('Recorded fixtures:', ', '.join(fixtures['recorded']) or 'none (synthetic payloads)')
+
+    results = {}
+
+    for scale in scales:
+        stages = benchmark_stages(scale_fixtures(fixtures, scale), repeat)
+        results[str(scale)] = stages
+
+        print('\nScale x{0}\n'.format(scale))
+        print('{0:24s} {1:>12s} {2:>12s} {3:>10s} {4:>8s}'.format(
+            'STAGE', 'WALL, ms', 'PEAK, KB', 'BLOCKS', 'ITEMS'))
+        for name, stage in stages.items():
+            print('{0:24s} {1:12.2f} {2:12.1f} {3:10d} {4:>8}'.format(
+                name, stage['wall'] * 1000, stage['peak'] / 1024, stage['blocks'], stage['items'] if stage['items'] is not None else '-'))
+
+    return results
+
+
+def benchmark_resolver(rows=100000):
+    '''
+    Country title resolution per row of a sub-national sized report:
+    legacy TITLES/CODES lookups vs CountryResolver (cold and warm)
+    '''
+    titles = list(main.COUNTRIES.values()) + list(main.TITLES) + \
+        ['Unknown Land {0}'.format(i) for i in range(20)]
+    names = [random.choice(titles) for _ in range(rows)]
+
+    def legacy():
+        for name in names:
+            name = main.TITLES.get(name, name)
+            main.CODES.get(name)
+
+    resolver = main.CountryResolver()
+
+    def cold():
+        resolver.lookups.clear()
+        for name in names:
+            resolver.resolve(name, 'JHU CSSE')
+
+    def warm():
+        resolve = resolver.lookup('JHU CSSE')
+        for name in names:
+            resolve(name)
+
+    results = {
+        'build': timed(main.CountryResolver),
+        'legacy': timed(legacy),
+        'cold': timed(cold),
+        'warm': timed(warm),
+    }
+    resolver.misses.clear()
+
+    print('CountryResolver build: {0:.2f} ms'.format(results['build'] * 1000))
+    for name in ('legacy', 'cold', 'warm'):
+        print('{0:8s} {1:8.1f} ns/row'.format(
+            name, results[name] / rows * 1e9))
+
+    return results
+
+
+def compare(results, previous):
+    '''
+    Print wall time and peak memory ratios against previous results
+    '''
+    print('\nCOMPARISON with', previous.get('commit') or 'previous run', '\n')
+
+    for scale, stages in results.get('pipeline', {}).items():
+        for name, stage in stages.items():
+            before = previous.get('pipeline', {}).get(scale, {}).get(name)
+            if not before:
+                continue
+
+            print('x{0:<4s} {1:24s} wall {2:6.2f}x  peak {3:6.2f}x'.format(
+                scale, name, stage['wall'] / before['wall'] if before['wall'] else 0, stage['peak'] / before['peak'] if before['peak'] else 0))
+
+
+BENCHMARKS = {
+    'pipeline': benchmark_pipeline,
+    'resolver': benchmark_resolver,
+}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='COVID-19 Data Factory benchmarks')
+    parser.add_argument('benchmarks', nargs='*', choices=sorted(BENCHMARKS) + [[]],
+                        help='benchmarks to run (all by default)')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100],
+                        help='pipeline fixtures scale-up factors')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of every stage (the best one is reported)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='save results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare results with JSON saved by a previous run')
+    parser.add_argument('--record', action='store_true',
+                        help='record live payloads of all the sources into fixtures/ and exit')
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures()
+        sys.exit()
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'date': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print('\n{0}\n'.format(name.upper()))
+        if name == 'pipeline':
+            results[name] = benchmark_pipeline(args.scale, args.repeat)
+        else:
+            results[name] = BENCHMARKS[name]()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('\nResults saved to', args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
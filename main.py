@@ -11,18 +11,33 @@ Combines the data and uploads on a Amazon S3-type Cloud-Storage
 import os
 import csv
 import json
+import time
+import random
+import argparse
+import re
+import mmap
+import bisect
+import gzip
+import codecs
+import unicodedata
+import hashlib
+import threading
+import sqlite3
+import queue
 import requests
 from io import StringIO
-from datetime import datetime
-
-from boto3 import session
-from botocore.client import Config
-from boto3.s3.transfer import S3Transfer
-
-from bs4 import BeautifulSoup
-
-import redis
-
+from types import MappingProxyType
+from functools import lru_cache, partial
+from contextlib import contextmanager, nullcontext, closing
+from collections import Counter, deque
+from urllib.parse import urlencode, urlsplit
+from array import array
+from html.parser import HTMLParser
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError, as_completed
+
+# boto3, bs4 and redis are imported lazily as long as each of them is used by an optional path only,
+# so is asyncio which is used by the API server only
 
 '''
 Amazon S3-type Storage Configuration
@@ -36,6 +51,33 @@ AWS_S3_CUSTOM_DOMAIN = os.environ.get('AWS_S3_CUSTOM_DOMAIN')
 AWS_S3_OBJECT_PARAMETERS = {
     'CacheControl': 'max-age=600',
 }
+S3_UPLOAD_CONCURRENCY = int(os.environ.get('S3_UPLOAD_CONCURRENCY', 16))
+
+
+'''
+Published artifacts: key, content type and Cache-Control of each output format.
+Artifacts larger than GZIP_MIN_SIZE bytes are stored gzip-compressed with Content-Encoding: gzip
+(except map.json which is kept uncompressed for the existing clients)
+'''
+ARTIFACTS = {
+    'map': ('covid-19/map.json', 'application/json; charset=utf-8', AWS_S3_OBJECT_PARAMETERS['CacheControl']),
+    'map_gzip': ('covid-19/map.json.gz', 'application/json; charset=utf-8', 'max-age=600'),
+    'csv': ('covid-19/map.csv', 'text/csv; charset=utf-8', 'max-age=600'),
+    'columns': ('covid-19/columns.json', 'application/json; charset=utf-8', 'max-age=600'),
+    'delta': ('covid-19/delta.json', 'application/json; charset=utf-8', 'max-age=60'),
+    'country': ('covid-19/countries/{0}.json', 'application/json; charset=utf-8', 'max-age=300'),
+}
+GZIP_MIN_SIZE = 1024
+
+
+'''
+Redis storage configuration (used if S3-type storage is not configured)
+Snapshots are stored under REDIS_PREFIX keys, REDIS_RETENTION latest versions are kept
+'''
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_PREFIX = os.environ.get('REDIS_PREFIX', 'covid_data')
+REDIS_RETENTION = int(os.environ.get('REDIS_RETENTION', 3))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 10))
 
 
 '''
@@ -47,11 +89,98 @@ MANUAL_DATA_SOURCE_URL = os.environ.get(
     'MANUAL_DATA_SOURCE_URL') if os.environ.get('MANUAL_DATA_SOURCE_URL') else None
 
 
+'''
+Fetch stage deadlines (in seconds)
+Every source is fetched in parallel and dropped from the run if it does not arrive in time.
+RUN_DEADLINE caps the whole fetch stage so a run never overlaps the next cron tick
+'''
+SOURCE_DEADLINES = {
+    'arcgis': int(os.environ.get('ARCGIS_DEADLINE', 120)),
+    'csse': int(os.environ.get('CSSE_DEADLINE', 40)),
+    'worldometer': int(os.environ.get('WORLDOMETER_DEADLINE', 40)),
+    'manual': int(os.environ.get('MANUAL_DEADLINE', 40)),
+}
+RUN_DEADLINE = int(os.environ.get('RUN_DEADLINE', 150))
+
+
+'''
+Last known good data of every source (SQLite database, set SOURCE_STORE_PATH to an empty string to disable it).
+A source which fails or misses its deadline is replaced by its latest stored data if it is not older than
+SOURCE_TTLS seconds; such sources are listed as stale in the published delta.
+A late source still updates the store in background for the next run
+'''
+SOURCE_STORE_PATH = os.environ.get('SOURCE_STORE_PATH', '/tmp/covid-19-sources.db')
+SOURCE_TTLS = {
+    'arcgis': int(os.environ.get('ARCGIS_TTL', 24 * 3600)),
+    'csse': int(os.environ.get('CSSE_TTL', 72 * 3600)),
+    'worldometer': int(os.environ.get('WORLDOMETER_TTL', 24 * 3600)),
+    'manual': int(os.environ.get('MANUAL_TTL', 7 * 24 * 3600)),
+}
+
+
+'''
+CSSE at JHU ArcGIS FeatureServer layer query endpoint.
+Features are fetched by pages of ARCGIS_PAGE_SIZE records, up to ARCGIS_CONCURRENCY pages at a time
+'''
+ARCGIS_LAYER_URL = os.environ.get(
+    'ARCGIS_LAYER_URL', 'https://services1.arcgis.com/0MSEUqKaxRlEPj5g/arcgis/rest/services/ncov_cases/FeatureServer/2/query')
+ARCGIS_PAGE_SIZE = int(os.environ.get('ARCGIS_PAGE_SIZE', 1000))
+ARCGIS_CONCURRENCY = int(os.environ.get('ARCGIS_CONCURRENCY', 4))
+ARCGIS_FIELDS = ('Country_Region', 'Confirmed',
+                 'Deaths', 'Recovered', 'Last_Update')
+
+
+'''
+Local fetch cache of upstream responses (validators, raw bodies and parsed data)
+Set FETCH_CACHE_DIR to an empty string to disable the cache
+'''
+FETCH_CACHE_DIR = os.environ.get('FETCH_CACHE_DIR', '/tmp/covid-19-cache')
+FETCH_CACHE_SIZE = int(os.environ.get('FETCH_CACHE_SIZE', 50 * 1024 * 1024))
+FETCH_CACHE_VERSION = 5
+
+
+'''
+Worldometer page parser:
+* stream — incremental extractor of the countries table (default)
+* soup — BeautifulSoup parse of the whole page
+* compare — run both parsers and report the differences (stream results are used)
+'''
+WORLDOMETER_PARSER = os.environ.get('WORLDOMETER_PARSER', 'stream')
+
+
+'''
+Daemon mode schedule (in seconds): a run starts every DAEMON_INTERVAL +/- DAEMON_JITTER seconds
+'''
+DAEMON_INTERVAL = int(os.environ.get('DAEMON_INTERVAL', 300))
+DAEMON_JITTER = int(os.environ.get('DAEMON_JITTER', 30))
+
+
+'''
+Embedded read API server address and pre-rendered top N responses sizes
+'''
+API_HOST = os.environ.get('API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('API_PORT', 8080))
+API_TOP_SIZES = (5, 10, 20, 50, 100)
+
+
+'''
+Directory of the time-series store keeping every published snapshot
+History is not stored if HISTORY_DIR is not set
+'''
+HISTORY_DIR = os.environ.get('HISTORY_DIR')
+
+
+'''
+Keep Province/State level detail of CSSE daily report in the output
+'''
+CSSE_PROVINCES = bool(os.environ.get('CSSE_PROVINCES'))
+
+
 COUNTRIES = {'CHN': 'China', 'ITA': 'Italy', 'IRN': 'Iran', 'KOR': 'Korea, South', 'ESP': 'Spain', 'DEU': 'Germany', 'FRA': 'France', 'USA': 'United States of America', 'CHE': 'Switzerland', 'NOR': 'Norway', 'DNK': 'Denmark', 'SWE': 'Sweden', 'NLD': 'Netherlands', 'GBR': 'United Kingdom', 'JPN': 'Japan', 'BEL': 'Belgium', 'AUT': 'Austria', 'QAT': 'Qatar', 'AUS': 'Australia', 'FIN': 'Finland', 'BHR': 'Bahrain', 'CAN': 'Canada', 'SGP': 'Singapore', 'MYS': 'Malaysia', 'GRC': 'Greece', 'ISR': 'Israel', 'BRA': 'Brazil', 'CZE': 'Czech Republic', 'SVN': 'Slovenia', 'HKG': 'Hong Kong S.A.R.', 'ISL': 'Iceland', 'PRT': 'Portugal', 'EST': 'Estonia', 'IRQ': 'Iraq', 'KWT': 'Kuwait', 'PHL': 'Philippines', 'ROU': 'Romania', 'IDN': 'Indonesia', 'LBN': 'Lebanon', 'EGY': 'Egypt', 'IRL': 'Ireland', 'SAU': 'Saudi Arabia', 'ARE': 'United Arab Emirates', 'IND': 'India', 'POL': 'Poland', 'THA': 'Thailand', 'SMR': 'San Marino', 'TWN': 'Taiwan', 'VNM': 'Vietnam', 'RUS': 'Russia', 'CHL': 'Chile', 'SRB': 'Serbia', 'ALB': 'Albania', 'LUX': 'Luxembourg', 'PER': 'Peru', 'DZA': 'Algeria', 'HRV': 'Croatia', 'BRN': 'Brunei', 'PAN': 'Panama', 'PSE': 'The Palestinian Territories', 'ARG': 'Argentina', 'SVK': 'Slovakia', 'BGR': 'Bulgaria', 'GEO': 'Georgia', 'PAK': 'Pakistan', 'BLR': 'Belarus', 'ECU': 'Ecuador', 'LVA': 'Latvia', 'CRI': 'Costa Rica', 'HUN': 'Hungary', 'ZAF': 'South Africa', 'SEN': 'Senegal', 'CYP': 'Cyprus', 'OMN': 'Oman', 'BIH': 'Bosnia and Herzegovina', 'MLT': 'Malta', 'TUN': 'Tunisia', 'COL': 'Colombia', 'AZE': 'Azerbaijan', 'ARM': 'Armenia', 'MEX': 'Mexico', 'MKD': 'North Macedonia', 'AFG': 'Afghanistan', 'MAC': 'Macau S.A.R', 'BOL': 'Bolivia', 'FRO': 'Faroe Islands', 'MDV': 'Maldives', 'MAR': 'Morocco', 'LKA': 'Sri Lanka', 'JAM': 'Jamaica', 'KHM': 'Cambodia', 'LTU': 'Lithuania', 'NZL': 'New Zealand', 'GUF': 'French Guiana', 'KAZ': 'Kazakhstan', 'MDA': 'Moldova', 'PRY': 'Paraguay', 'DOM': 'Dominican Republic', 'TUR': 'Turkey', 'CUB': 'Cuba', 'LIE': 'Liechtenstein', 'URY': 'Uruguay', 'UKR': 'Ukraine', 'BGD': 'Bangladesh', 'PYF': 'French Polynesia',
              'PRI': 'Puerto Rico', 'MCO': 'Monaco', 'NGA': 'Nigeria', 'ABW': 'Aruba', 'BFA': 'Burkina Faso', 'CMR': 'Cameroon', 'GHA': 'Ghana', 'HND': 'Honduras', 'NAM': 'Namibia', 'MAF': 'Saint Martin', 'TTO': 'Trinidad and Tobago', 'VEN': 'Venezuela', 'GUY': 'Guyana', 'SDN': 'Sudan', 'AND': 'Andorra', 'JOR': 'Jordan', 'NPL': 'Nepal', 'ATG': 'Antigua and Barbuda', 'BTN': 'Bhutan', 'CYM': 'Cayman Islands', 'CIV': "Ivory Coast (Côte d'Ivoire)", 'CUW': 'Curaçao', 'ETH': 'Ethiopia', 'GAB': 'Gabon', 'GTM': 'Guatemala', 'GIN': 'Guinea', 'VAT': 'Vatican (Holy See)', 'KEN': 'Kenya', 'MRT': 'Mauritania', 'MNG': 'Mongolia', 'RWA': 'Rwanda', 'LCA': 'Saint Lucia', 'VCT': 'Saint Vincent and the Grenadines', 'SUR': 'Suriname', 'TGO': 'Togo', 'REU': 'Réunion', 'MTQ': 'Martinique', 'GLP': 'Guadeloupe', 'UZB': 'Uzbekistan', 'KGZ': 'Kyrgyz Republic', 'KOS': 'Kosovo', 'MNE': 'Montenegro', 'TKM': 'Turkmenistan', 'TJK': 'Tajikistan', 'COG': 'Congo', 'LBR': 'Liberia', 'CAF': 'Central African Republic', 'TZA': 'Tanzania', 'SOM': 'Somalia', 'GRL': 'Greenland', 'BEN': 'Benin', 'BHS': 'Bahamas', 'SYC': 'Seychelles', 'GUM': 'Guam', 'BLM': 'St. Barths', 'COD': 'Democratic Republic of the Congo', 'GNQ': 'Equatorial Guinea', 'VIR': 'U.S. Virgin Islands', 'ZMB': 'Zambia', 'NCL': 'New Caledonia', 'BRB': 'Barbados', 'GMB': 'Gambia', 'MSR': 'Montserrat', 'DJI': 'Djibouti', 'GBX': 'Channel Islands', 'MYT': 'Mayotte', 'SWZ': 'Eswatini', 'GIB': 'Gibraltar', 'DPX': 'Diamond Princess (Cruise Ship)', 'MUS': 'Mauritius', 'NIC': 'Nicaragua', 'FJI': 'Fiji', 'SLV': 'El Salvador', 'BMU': 'Bermuda', 'TCD': 'Chad', 'HTI': 'Haiti', 'AGO': 'Angola', 'CPV': 'Cape Verde', 'IMN': 'Isle of Man', 'NER': 'Niger', 'PNG': 'Papua New Guinea', 'MDG': 'Madagascar', 'ZWE': 'Zimbabwe', 'ERI': 'Eritrea', 'GRD': 'Grenada', 'MOZ': 'Mozambique', 'SYR': 'Syria', 'UGA': 'Uganda', 'TLS': 'Timor-Leste', 'DMA': 'Dominica', 'BLZ': 'Belize', 'LAO': 'Laos', 'LBY': 'Libya', 'MMR': 'Myanmar', 'MLI': 'Mali', 'GNB': 'Guinea-Bissau', 'KNA': 'Saint Kitts and Nevis', 'VGB': 'British Virgin Islands', 'MZX': 'MS Zaandam (Cruise Ship)', 'BWA': 'Botswana', 'AIA': 'Anguilla', 'SLE': 'Sierra Leone', 'BDI': 'Burundi', 'MWI': 'Malawi', 'SDS': 'South Sudan', 'SAH': 'Western Sahara'}
 
 
-CODES = {}
+CODES = {title: code for code, title in COUNTRIES.items()}
 
 '''
 Used to normalize country titles as long as each data source has own naming standard
@@ -100,380 +229,3424 @@ TITLES = {
     '': '',
 }
 
+'''
+Country titles specific for a data source, take precedence over TITLES
+'''
+SOURCE_TITLES = {
+    'JHU CSSE': {
+        'Others': 'Diamond Princess (Cruise Ship)',
+        'Bahamas, The': 'Bahamas',
+        'The Bahamas': 'Bahamas',
+        'Gambia, The': 'Gambia',
+        'The Gambia': 'Gambia',
+        'Republic of Ireland': 'Ireland',
+        'North Ireland': 'United Kingdom',
+        'Guernsey': 'Channel Islands',
+        'Jersey': 'Channel Islands',
+        'Saint Barthelemy': 'St. Barths',
+    },
+}
+
 
-class CovidDataFactory(object):
+'''
+Data sources merge policy: for each country the sources are applied in the given order with a rule per metric
+(a single rule applies to all the metrics):
+* base — the value is used only if the country has no data yet
+* max — the value is used if it is greater than the current one
+* override — the value always replaces the current one
+Latest update label and source of a country are taken from the last source which changed any of its metrics
+'''
+MERGE_POLICY = {
+    'default': (
+        ('arcgis', 'base'),
+        ('csse', 'max'),
+        ('worldometer', 'base'),
+        ('manual', 'override'),
+    ),
+}
 
-    def __init__(self):
+# Countries where Worldometer data is more accurate than CSSE
+MERGE_POLICY.update({code: (
+    ('arcgis', 'base'),
+    ('csse', 'max'),
+    ('worldometer', 'override'),
+    ('manual', 'override'),
+) for code in ('SRB', 'KGZ', 'KAZ', 'RUS', 'UKR', 'MZX', 'UZB',)})
 
-        self.covid_data = {}  # App Data Storage
 
-        for code in COUNTRIES:
-            CODES[COUNTRIES[code]] = code
+'''
+Publisher state directory: content hash of the last published snapshot is kept here
+(and as the object metadata) so unchanged data is not uploaded again
+'''
+PUBLISH_STATE_DIR = os.environ.get('PUBLISH_STATE_DIR', '/tmp/covid-19-publish')
 
-    def execute(self):
 
-        print('\nSTART\n')
+'''
+Print a table with the contribution of every data source after the merge
+'''
+MERGE_DIAGNOSTICS = bool(os.environ.get('MERGE_DIAGNOSTICS'))
 
-        self.covid_data = self.read_arcgis()
-        self.combine_data()
 
-        if not self.validate_json():
-            print("COVID JSON data validation fail")
-            raise
+'''
+Validation of merged data against the previous snapshot. Only changed countries are checked:
+* a record should have some cases, no negative values and deaths + recovered should not exceed confirmed
+* a count should not decrease by more than VALIDATION_MAX_DECREASE share of its previous value
+* a count of at least VALIDATION_JUMP_BASE should not grow more than VALIDATION_MAX_JUMP times
+* a country source should not change more than VALIDATION_FLAP_LIMIT times within VALIDATION_FLAP_WINDOW latest updates
+A record breaking the rules is quarantined (its last accepted values are published instead),
+a record breaking only BACKWARDS/JUMP/FLAPPING rules is accepted as a revision once it arrives unchanged
+VALIDATION_QUARANTINE_RUNS times in a row.
+A run fails if more than VALIDATION_MAX_QUARANTINE share of the countries is quarantined
+'''
+VALIDATION_MAX_DECREASE = float(os.environ.get('VALIDATION_MAX_DECREASE', 0.0))
+VALIDATION_MAX_JUMP = float(os.environ.get('VALIDATION_MAX_JUMP', 10.0))
+VALIDATION_JUMP_BASE = int(os.environ.get('VALIDATION_JUMP_BASE', 100))
+VALIDATION_FLAP_WINDOW = int(os.environ.get('VALIDATION_FLAP_WINDOW', 6))
+VALIDATION_FLAP_LIMIT = int(os.environ.get('VALIDATION_FLAP_LIMIT', 3))
+VALIDATION_QUARANTINE_RUNS = int(os.environ.get('VALIDATION_QUARANTINE_RUNS', 3))
+VALIDATION_MAX_QUARANTINE = float(os.environ.get('VALIDATION_MAX_QUARANTINE', 0.2))
+VALIDATION_VECTOR_MIN = 1000  # number of rows from which the checks are vectorized with numpy
 
-        if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
-            print(
-                '\nNo S3-type Storage Available.\nTrying to store data into Redis.')
-            result = self.save_to_redis()
-        else:
-            result = self.save_to_cloud()
 
-        print('Saving JSON:', 'OK' if result else 'ERROR')
+'''
+Run metrics: stage timings and counters of the last run are written into METRICS_DIR as
+a Prometheus textfile (covid19.prom, for node_exporter textfile collector) and appended to runs.jsonl.
+METRICS_META embeds a small _meta block (run id, generation time, rows per source) into map.json.
+Metrics are not collected if neither is set
+'''
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_META = bool(os.environ.get('METRICS_META'))
+
+
+class CountryResolver(object):
+    '''
+    Immutable country title to ISO code index built once per process.
+    Titles are matched after casefolding, diacritics and punctuation normalization
+    with source-specific aliases (SOURCE_TITLES) taking precedence over common ones (TITLES).
+    Both hits and misses are kept in a bounded LRU cache,
+    unknown titles are counted and reported once per run by report_misses()
+    '''
+
+    def __init__(self, countries=COUNTRIES, titles=TITLES, source_titles=SOURCE_TITLES, cache_size=8192):
+
+        codes = {title: code for code, title in countries.items()}
+
+        common = {}
+        for code, title in countries.items():
+            self.add(common, title, code)
+        for alias, title in titles.items():
+            if title in codes:
+                self.add(common, alias, codes[title])
+
+        sources = {}
+        for source, aliases in source_titles.items():
+            sources[source] = {}
+            for alias, title in aliases.items():
+                if title in codes:
+                    self.add(sources[source], alias, codes[title])
+
+        self.common = MappingProxyType(common)
+        self.sources = MappingProxyType(
+            {source: MappingProxyType(index) for source, index in sources.items()})
+
+        self.cache_size = cache_size
+        self.lookups = {}
+        self.misses = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(title):
+        '''
+        Casefold the title, strip diacritics and replace punctuation with spaces
+        '''
+        title = unicodedata.normalize('NFKD', title)
+        title = ''.join(c for c in title if not unicodedata.combining(c))
+        title = re.sub(r'[\W_]+', ' ', title.casefold().replace('&', ' and '))
+
+        return ' '.join(title.split())
 
-        print('\nEND\n')
+    def add(self, index, title, code):
 
-        return result
+        key = self.normalize(title)
+        if index.get(key, code) != code:
+            raise ValueError('Ambiguous country title ' + title)
+        index[key] = code
 
-    def validate_json(self):
+    def find(self, title, source=''):
         '''
-        Check number of records to Save
+        Resolve the title without caching
         '''
+        key = self.normalize(title)
 
-        # Should be less or equal to original list of countries and at list 100
-        # items long
-        if len(COUNTRIES) >= len(self.covid_data) > 100:
+        if source in self.sources and key in self.sources[source]:
+            return self.sources[source][key]
 
-            for code, data in self.covid_data.items():
+        return self.common.get(key)
 
-                # Check Confirmed/Deaths/Recovered values and control sum
-                if not (data['confirmed'] > 0 or data['deaths'] > 0 or data['recovered'] > 0) or not (data['confirmed'] >= data['deaths'] + data['recovered']):
-                    print(data)
-                    raise ValueError
+    def lookup(self, source=''):
+        '''
+        Return LRU cached title resolution function of the source.
+        It costs a single dict lookup per call for known titles, misses are not counted
+        '''
+        if source not in self.lookups:
+            with self.lock:
+                if source not in self.lookups:
+                    self.lookups[source] = lru_cache(maxsize=self.cache_size)(
+                        lambda title: self.find(title, source))
 
-            # Return True if data is valid
-            return True
+        return self.lookups[source]
 
-        # Invalid nuber of records
-        return False
+    def miss(self, title, source=''):
 
-    def add_country_data(self, country_name=None, confirmed=0, deaths=0, recovered=0, latest_update=None, source=''):
+        with self.lock:
+            self.misses[(title, source)] += 1
+
+    def resolve(self, title, source=''):
         '''
-        Normalize Country title
-        Return a dictionary with COVID-19 country data with source, latest update label and county ISO code
+        Return country ISO code of the title or None
         '''
-        if country_name in TITLES:
-            country_name = TITLES[country_name]
+        code = self.lookup(source)(title)
 
-        if country_name in CODES:
-            country_code = CODES[country_name]
+        if code is None:
+            self.miss(title, source)
 
-            return {
-                'code': country_code,
-                'confirmed': self.parse_num(confirmed),
-                'deaths': self.parse_num(deaths),
-                'recovered': self.parse_num(recovered),
-                'latest_update': latest_update,
-                'source': source
-            }
+        return code
 
-        print(f'- {country_name} title from {source} not found')
+    def calls(self):
+        '''
+        Return total number of resolved titles per source since the process start.
+        Taken from the LRU cache statistics, so counting costs nothing per row
+        '''
+        with self.lock:
+            lookups = dict(self.lookups)
 
-        return None
+        return {source: info.hits + info.misses for source, info in
+                ((source, lookup.cache_info()) for source, lookup in lookups.items())}
 
-    def read_covid_csse(self):
+    def report_misses(self):
         '''
-        Fetch data from CSSE at JHU COVID-19 github repo.
-        Always retrieve yesterday CVS as long as CSSE updates it on a daily basis
-        Returns a dictionary with data
+        Print unknown titles with number of occurrences since the last report and reset the counters
+        Return the counters as {(title, source): rows}
         '''
+        with self.lock:
+            misses, self.misses = self.misses, Counter()
 
-        covid_data = {}
-        day = datetime.now().day - 1
+        for (title, source), count in sorted(misses.items()):
+            print(f'- {title} title from {source} not found ({count} rows)')
 
-        r = requests.get('https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_daily_reports/{0}-{1}-2020.csv'.format(
-            datetime.now().strftime('%m'), str(day) if day > 9 else '0{}'.format(day)), timeout=40)
+        return misses
 
-        if r.status_code != requests.codes.ok:
-            exit('Died from Coronavirus trying to fetch latest data from github')
 
-        csv_reader = csv.reader(StringIO(r.text), delimiter=',')
-        line = 0
+RESOLVER = CountryResolver()
 
-        for row in csv_reader:
 
-            if line > 0:
-                country_name = row[3]
-                latest_update = row[4]
-                confirmed = int(row[7])
-                deaths = int(row[8])
-                recovered = int(row[9])
+class PipelineConfig(object):
+    '''
+    Configuration of a published product: countries subset, country titles, storage keys,
+    manual data source and Province/State detail. The default one reproduces the module level settings.
+    Other pipelines publish under their own keys (covid-19/{name}/map.json, {REDIS_PREFIX}_{name} keys)
+    and keep local state (fetch cache, publish state, metrics) apart from the default one
+    '''
 
-                obj = self.add_country_data(
-                    country_name, confirmed, deaths, recovered, latest_update, 'JHU CSSE')
+    DEFAULT = 'default'
 
-                if obj:
-                    covid_data[obj['code']] = obj
+    def __init__(self, name=DEFAULT, countries=None, titles=None, manual_url=None, provinces=None,
+                 key_prefix=None, redis_prefix=None, history_dir=None, merge_policy=None, min_countries=None):
+
+        default = name == self.DEFAULT
 
-            line += 1
+        self.name = name
+        self.countries = MappingProxyType(dict(COUNTRIES if countries is None else countries))
+        self.titles = MappingProxyType(dict(TITLES if titles is None else titles))
+        self.manual_url = MANUAL_DATA_SOURCE_URL if manual_url is None else manual_url
+        self.provinces = CSSE_PROVINCES if provinces is None else bool(provinces)
+        self.key_prefix = key_prefix or ('covid-19' if default else 'covid-19/' + name)
+        self.redis_prefix = redis_prefix or (REDIS_PREFIX if default else REDIS_PREFIX + '_' + name)
+        self.history_dir = HISTORY_DIR if history_dir is None and default else history_dir
+        self.merge_policy = MERGE_POLICY if merge_policy is None else merge_policy
 
-        return covid_data
+        # Should be more than 100 countries in the whole world data
+        self.min_countries = min_countries if min_countries is not None else (
+            100 if len(self.countries) >= len(COUNTRIES) else len(self.countries) // 2)
 
-    def read_manual_data(self):
+        self.artifacts = {artifact: (key.replace('covid-19/', self.key_prefix + '/', 1), content_type, cache_control)
+                          for artifact, (key, content_type, cache_control) in ARTIFACTS.items()}
+
+    @classmethod
+    def from_dict(cls, options):
         '''
-        Fetch manual populated data from a Google Spreadsheet
-        Return a dictionary with data
+        Build a configuration from a JSON object, countries may be given as a list of ISO codes
         '''
-        data = {}
+        options = dict(options)
+        countries = options.get('countries')
 
-        if not MANUAL_DATA_SOURCE_URL:
-            print('! No manual data source provided')
-            return data
+        if isinstance(countries, list):
+            unknown = [code for code in countries if code not in COUNTRIES]
+            if unknown:
+                raise ValueError('Unknown country codes: ' + ', '.join(unknown))
+            options['countries'] = {code: COUNTRIES[code] for code in countries}
 
-        r = requests.get(MANUAL_DATA_SOURCE_URL, timeout=40)
-        r.encoding = 'utf-8'
+        return cls(**options)
 
-        if r.status_code != requests.codes.ok:
-            print('! Can not fetch manual data from', MANUAL_DATA_SOURCE_URL)
-            return data
+    @classmethod
+    def union(cls, configs, name='shared'):
+        '''
+        Configuration fetching the data for all the configurations (no manual data source)
+        '''
+        countries = dict(COUNTRIES)
+        titles = dict(TITLES)
 
-        try:
-            csv_reader = csv.reader(StringIO(r.text), delimiter=',')
-            line = 0
-            for row in csv_reader:
-                if line > 0:
+        for config in configs:
+            countries.update(config.countries)
+            titles.update(config.titles)
 
-                    obj = self.add_country_data(country_name=row[0], confirmed=row[1], deaths=row[
-                                                2], recovered=row[3], latest_update=row[5], source=row[4])
+        return cls(name, countries=countries, titles=titles, manual_url='',
+                   provinces=any(config.provinces for config in configs))
 
-                    if obj:
-                        data[obj['code']] = obj
+    @property
+    def default(self):
+        return self.name == self.DEFAULT
 
-                line += 1
+    def parse_key(self):
+        '''
+        Return hash of the options the parsed source data depends on (country titles resolution and provinces)
+        '''
+        options = [sorted(self.countries.items()), sorted(self.titles.items()), self.provinces]
 
-        except Exception as e:
-            print('! Error parsing manual data from', MANUAL_DATA_SOURCE_URL)
-            data = {}
+        return hashlib.sha1(json.dumps(options, ensure_ascii=False).encode('utf-8')).hexdigest()
 
-        return data
+    def state_path(self, path):
+        '''
+        Local state directory of the pipeline inside the default one
+        '''
+        if not path or self.default:
+            return path
 
-    def read_arcgis(self):
+        return os.path.join(path, self.name)
+
+    def resolver(self):
         '''
-        Fetch data from CSSE at JHU COVID-19 ArcGIS service
-        Return a dictionary with data
+        Return the shared RESOLVER unless the configuration adds countries or titles to the module ones
         '''
+        if all(COUNTRIES.get(code) == title for code, title in self.countries.items()) and \
+                all(TITLES.get(alias) == title for alias, title in self.titles.items()):
+            return RESOLVER
 
-        data = {}
+        return CountryResolver(countries=dict(COUNTRIES, **self.countries), titles=dict(TITLES, **self.titles))
 
-        response = requests.get('https://services1.arcgis.com/0MSEUqKaxRlEPj5g/arcgis/rest/services/ncov_cases/FeatureServer/2/query?f=json&where=1%3D1&returnGeometry=false&spatialRel=esriSpatialRelIntersects&outFields=*&orderByFields=OBJECTID%20ASC&outSR=102100&resultOffset=0&resultRecordCount=250&cacheHint=true&quantizationParameters=%7B%22mode%22%3A%22edit%22%7D', timeout=120)
 
-        if response.status_code != requests.codes.ok:
-            print('! Unable to fetch latest data from CSSE at JHU ArcGIS')
-            return data
+'''
+CSSE at JHU daily reports changed the header a few times,
+the map below brings every known layout to the same column names
+'''
+CSSE_COLUMNS = {
+    'Country/Region': 'country',
+    'Country_Region': 'country',
+    'Last Update': 'latest_update',
+    'Last_Update': 'latest_update',
+    'Confirmed': 'confirmed',
+    'Deaths': 'deaths',
+    'Recovered': 'recovered',
+    'Province/State': 'province',
+    'Province_State': 'province',
+}
+CSSE_REPORT_NAME = re.compile(r'^(\d{2})-(\d{2})-(\d{4})\.csv$')
 
-        json_data = json.loads(response.text)
 
-        if not 'features' in json_data:
-            print('! Wrong data format from CSSE at JHU ArcGIS')
-            return data
+class DaemonExecutor(object):
+    '''
+    Minimal thread pool running tasks on daemon threads.
+    ThreadPoolExecutor workers are joined at interpreter exit, so a source which missed its deadline
+    would keep a cron run alive until its request ends. Daemon workers are abandoned at exit instead
+    '''
 
-        for item in json_data['features']:
+    def __init__(self, max_workers):
 
-            obj = self.add_country_data(
-                country_name=item['attributes']['Country_Region'], confirmed=item['attributes']['Confirmed'], deaths=item['attributes']['Deaths'], recovered=item['attributes']['Recovered'], latest_update=datetime.fromtimestamp(item['attributes']['Last_Update'] / 1000).strftime("%Y/%m/%d, %H:%M:%S"), source='JHU CSSE')
+        self.max_workers = max_workers
+        self.workers = 0
+        self.tasks = queue.SimpleQueue()
+        self.lock = threading.Lock()
 
-            if obj:
-                data[obj['code']] = obj
+    def submit(self, func, *args, **kwargs):
 
-        return data
+        future = Future()
+        self.tasks.put((future, func, args, kwargs))
 
-    def read_worldometer(self):
-        '''
-        Fetch data from COVID-19 page on Worldometer website
-        https://www.worldometers.info/coronavirus/
+        with self.lock:
+            if self.workers < self.max_workers:
+                self.workers += 1
+                threading.Thread(target=self.work, daemon=True).start()
 
-        Return a dictionary with data
+        return future
+
+    def work(self):
+
+        while True:
+            with self.lock:
+                try:
+                    future, func, args, kwargs = self.tasks.get_nowait()
+                except queue.Empty:
+                    self.workers -= 1
+                    return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, cancel_futures=True):
         '''
+        Cancel pending tasks, running ones are not waited for
+        '''
+        while cancel_futures:
+            try:
+                future, _, _, _ = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
 
-        data = {}
 
-        url = 'https://www.worldometers.info/coronavirus/'
-        response = requests.get(url, timeout=40)
+class FetchCache(object):
+    '''
+    Persistent size-bounded cache of upstream responses on local disk.
+    Every URL is stored as a pair of files: <key>.body with the raw response body and
+    <key>.json with HTTP validators, body hash and the parsed data.
+    Parsed data depends on the parse options (see PipelineConfig.parse_key()),
+    entries stored with other options are treated as misses.
+    Least recently used entries are removed once the cache grows over max_size bytes
+    '''
 
-        if response.status_code != requests.codes.ok:
-            print('! Unable to fetch latest data from Worldometer')
-            return data
+    def __init__(self, path=FETCH_CACHE_DIR, max_size=FETCH_CACHE_SIZE, options=None):
 
-        html = BeautifulSoup(response.text, "html.parser")
-        table = html.find('table', id='main_table_countries_today')
+        self.path = path
+        self.max_size = max_size
+        self.options = options
+        self.lock = threading.Lock()
 
-        for row in table.find('tbody').find_all('tr'):
-            cells = row.find_all('td')
+        os.makedirs(self.path, exist_ok=True)
 
-            obj = self.add_country_data(country_name=cells[0].text.strip(), confirmed=self.parse_num(cells[1].text), deaths=self.parse_num(
-                cells[3].text), recovered=self.parse_num(cells[5].text), latest_update=datetime.now().strftime("%Y/%m/%d, %H:%M:%S"), source='Worldometer')
+    def filename(self, url, ext):
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest() + ext)
 
-            if obj:
-                data[obj['code']] = obj
+    def load(self, url):
+        '''
+        Return cached entry for the URL or None
+        '''
+        try:
+            with open(self.filename(url, '.json'), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
 
-        return data
+        if entry.get('version') != FETCH_CACHE_VERSION or entry.get('url') != url or \
+                entry.get('options') != self.options:
+            return None
+
+        return entry
 
-    def combine_data(self):
+    def touch(self, url):
         '''
-        Walks through all data sources and combines data using the rule:
-        * First priority — ArcGIS data added into covid_data
-        * If a country not found in ArcGIS but presents in CSSE git repo — append it to covid_data
-        * If a country presents in Worldometer and cannot be found in our storage (or country code is among the list: SRB, KGZ, KAZ, RUS, UKR, MZX, UZB) - append it
-        * If a country presents in manually updated dictionary — overwrite the data in storage
+        Mark the entry as recently used
+        '''
+        for ext in ('.json', '.body'):
+            try:
+                os.utime(self.filename(url, ext))
+            except OSError:
+                pass
 
-        Returns a dictionary with data
+    def open_body(self, url):
+        '''
+        Open a temporary file to stream response body into.
+        The file replaces cached body once the entry is stored
+        '''
+        return open('{0}.{1}.tmp'.format(self.filename(url, '.body'), threading.get_ident()), 'wb')
+
+    def store(self, url, response, body_hash, data, body_file=None):
+        '''
+        Save response body (or move streamed body_file in place), its validators and parsed data
         '''
+        entry = {
+            'version': FETCH_CACHE_VERSION,
+            'url': url,
+            'options': self.options,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'hash': body_hash,
+            'data': data,
+        }
 
-        wom_data = self.read_worldometer()
-        csse = self.read_covid_csse()
-        man_data = self.read_manual_data()
-
-        print('\nTotal items in CSSE ArcGIS source:', len(self.covid_data))
-        print('Total items in CSSE github repo:', len(csse))
-        print('Total items on Worldometer website:', len(wom_data))
-        print('Total items in Manual Data source:', len(man_data), '\n')
-
-        print("-" * 63 + "|")
-
-        print("{code:8s} | {c:15s} | {d:15s} | {r:15s} |".format(
-            code='CODE', c='   CONFIRMED', d='    DEATHS', r='  RECOVERED'))
-        print("-" * 63 + "|")
-
-        for code in csse:
-            if code in self.covid_data:
-                title = code
-                if self.covid_data[code]['confirmed'] < csse[code]['confirmed'] or self.covid_data[code]['deaths'] < csse[code]['deaths'] or self.covid_data[code]['recovered'] < csse[code]['recovered']:
-                    extra = ''
-                    if self.covid_data[code]['confirmed'] < csse[code]['confirmed']:
-                        self.covid_data[code][
-                            'confirmed'] = csse[code]['confirmed']
-                        extra += 'C'
-                    if self.covid_data[code]['deaths'] < csse[code]['deaths']:
-                        self.covid_data[code]['deaths'] = csse[code]['deaths']
-                        extra += 'D'
-                    if self.covid_data[code]['recovered'] < csse[code]['recovered']:
-                        self.covid_data[code][
-                            'recovered'] = csse[code]['recovered']
-                        extra += 'R'
-                    self.covid_data[code]['latest_update'] = csse[code]['latest_update'].replace(
-                        'T', ' ')
-                    self.covid_data[code]['source'] = 'JHU CSSE'
-                    title = "> {1}+{0}".format(extra, title)
-
-                print("{code:8s} | {c1:6d} | {c2:6d} | {d1:6d} | {d2:6d} | {r1:6d} | {r2:6d} |".format(code=title, c1=self.covid_data[code]['confirmed'], c2=csse[code][
-                      'confirmed'], d1=self.covid_data[code]['deaths'], d2=csse[code]['deaths'], r1=self.covid_data[code]['recovered'], r2=csse[code]['recovered']))
+        try:
+            if body_file:
+                os.replace(body_file, self.filename(url, '.body'))
             else:
-                # print('Adding', code, 'from CSSE')
-                print("{code:8s} | {c1:6d} | {c2:6d} | {d1:6d} | {d2:6d} | {r1:6d} | {r2:6d} |".format(code="+ " + code, c1=0, c2=csse[code][
-                      'confirmed'], d1=0, d2=csse[code]['deaths'], r1=0, r2=csse[code]['recovered']))
-                self.covid_data[code] = csse[code]
-                self.covid_data[code]['latest_update'] = self.covid_data[code]['latest_update'].replace(
-                    'T', ' ')
-                self.covid_data[code]['source'] = 'JHU CSSE'
-                # print(self.covid_data[code]['latest_update'])
-
-        print("-" * 63 + "|")
-
-        if(len(wom_data)):
-
-            print("-" * 19 + " ADDING FROM WORLDOMETER " + "-" * 19 + '|')
-            print("-" * 63 + "|")
-
-            for code in wom_data:
-                if code not in self.covid_data or code in ('SRB', 'KGZ', 'KAZ', 'RUS', 'UKR', 'MZX', 'UZB',):
-                    if code in COUNTRIES:
-                        print("{code:8s} | {c1:6d} | {c2:6d} | {d1:6d} | {d2:6d} | {r1:6d} | {r2:6d} |".format(
-                            code="++ " + code, c1=self.covid_data[code]['confirmed'] if 'code' in self.covid_data else 0, c2=wom_data[code]['confirmed'], d1=self.covid_data[code]['deaths'] if 'code' in self.covid_data else 0, d2=wom_data[code]['deaths'], r1=self.covid_data[code]['recovered'] if 'code' in self.covid_data else 0, r2=wom_data[code]['recovered']))
-                        self.covid_data[code] = {
-                            'confirmed': wom_data[code]['confirmed'],
-                            'deaths': wom_data[code]['deaths'],
-                            'recovered': wom_data[code]['recovered'],
-                            'latest_update': wom_data[code]['latest_update'],
-                            'source': wom_data[code]['source']
-                        }
+                self.write(self.filename(url, '.body'), response.content)
+            self.write(self.filename(url, '.json'), json.dumps(
+                entry, ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            print('! Unable to store fetch cache entry for', url, e)
+            return
+
+        self.trim()
+
+    def write(self, filename, content):
+        tmp = '{0}.{1}.tmp'.format(filename, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, filename)
+
+    def trim(self):
+        '''
+        Remove least recently used files until the cache fits max_size
+        '''
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.path):
+                # Remove temporary files left by fetches abandoned at exit
+                if entry.is_file() and entry.name.endswith('.tmp') and entry.stat().st_mtime < time.time() - 3600:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
 
-                    else:
-                        print('! CODE NOT FOUND', code)
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
 
-            print("-" * 63 + "|")
+            total = sum(size for _, size, _ in files)
 
-        if(len(man_data)):
+            for _, size, path in sorted(files):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
 
-            print("-" * 18 + " ADDING FROM MANUAL INPUT " + "-" * 19 + "|")
-            print("-" * 63 + "|")
 
-            for code in man_data:
-                print("{code:8s} | {c1:6d} | {c2:6d} | {d1:6d} | {d2:6d} | {r1:6d} | {r2:6d} |".format(
-                    code="++ " + code, c1=self.covid_data[code]['confirmed'] if 'code' in self.covid_data else 0, c2=man_data[code]['confirmed'], d1=self.covid_data[code]['deaths'] if 'code' in self.covid_data else 0, d2=man_data[code]['deaths'], r1=self.covid_data[code]['recovered'] if 'code' in self.covid_data else 0, r2=man_data[code]['recovered']))
-                self.covid_data[code] = {
-                    'confirmed': man_data[code]['confirmed'],
-                    'deaths': man_data[code]['deaths'],
-                    'recovered': man_data[code]['recovered'],
-                    'latest_update': man_data[code]['latest_update'],
-                    'source': man_data[code]['source']
-                }
+class WorldometerTableParser(HTMLParser):
+    '''
+    Incremental extractor of the rows of the first <tbody> of a table with the given id.
+    Everything outside of the table is skipped and no DOM is built:
+    completed rows are collected as lists of cell texts in self.rows and
+    self.done is set once the <tbody> is over
+    '''
 
-            print("-" * 63 + "|")
+    def __init__(self, table_id='main_table_countries_today'):
 
-        return None
+        super().__init__(convert_charrefs=True)
+
+        self.table_id = table_id
+        self.rows = []
+        self.done = False
+
+        self.depth = 0  # Tables nesting level inside the target table
+        self.in_tbody = False
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+
+        if self.done:
+            return
+
+        if tag == 'table':
+            if self.depth:
+                self.depth += 1
+            elif dict(attrs).get('id') == self.table_id:
+                self.depth = 1
+
+        elif self.depth != 1:
+            return
+
+        elif tag == 'tbody':
+            self.in_tbody = True
+
+        elif not self.in_tbody:
+            return
+
+        elif tag == 'tr':
+            self.end_row()
+            self.row = []
+
+        elif tag == 'td' and self.row is not None:
+            self.end_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+
+        if self.done or not self.depth:
+            return
+
+        if tag == 'table':
+            self.depth -= 1
+            if not self.depth:
+                self.end_row()
+                self.done = True
+
+        elif self.depth != 1 or not self.in_tbody:
+            return
+
+        elif tag == 'td':
+            self.end_cell()
+
+        elif tag == 'tr':
+            self.end_row()
+
+        elif tag == 'tbody':
+            self.end_row()
+            self.done = True
+
+    def handle_data(self, data):
+
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def end_cell(self):
+
+        if self.cell is not None:
+            self.row.append(''.join(self.cell))
+            self.cell = None
+
+    def end_row(self):
+
+        self.end_cell()
+
+        if self.row is not None:
+            self.rows.append(self.row)
+            self.row = None
+
+
+class HistoryStore(object):
+    '''
+    Append-only columnar store of every published snapshot.
+
+    Files inside the store directory:
+    * values.bin — int64 array of frames, one frame per snapshot with slots x metrics cells (-1 if missing)
+    * sources.bin — uint16 array of frames, one frame per snapshot with an index in the sources dictionary per slot
+    * timestamps.bin — int64 array with UNIX timestamp of each snapshot
+    * meta.json — country slots, metrics and sources dictionary
+
+    Data files are memory-mapped, so a country series or the whole world at one timestamp
+    are zero-copy memoryview slices. Single writer is assumed
+    '''
+
+    METRICS = ('confirmed', 'deaths', 'recovered')
+    MISSING = -1
+    NO_SOURCE = 0xFFFF
+
+    def __init__(self, path=HISTORY_DIR, slots=256):
+
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
 
-    def save_to_cloud(self):
-        '''
-        Store our data inside Amazon S3-type Cloud Storage
-        '''
         try:
-            s3session = session.Session()
-            client = s3session.client('s3',
-                                      region_name=AWS_S3_CUSTOM_DOMAIN,
-                                      endpoint_url=AWS_S3_ENDPOINT_URL,
-                                      aws_access_key_id=AWS_ACCESS_KEY,
-                                      aws_secret_access_key=AWS_SECRET_KEY)
-
-            client.put_object(Bucket=AWS_STORAGE_BUCKET_NAME, Key='covid-19/map.json',
-                              Body=json.dumps(this.covid_data, ensure_ascii=False))
-            response = client.put_object_acl(
-                ACL='public-read', Bucket=AWS_STORAGE_BUCKET_NAME, Key="covid-19/map.json")
-            return True
+            with open(self.filename('meta.json'), encoding='utf-8') as f:
+                self.meta = json.load(f)
+        except FileNotFoundError:
+            self.meta = {
+                'version': 1,
+                'slots': max(slots, len(COUNTRIES)),
+                'metrics': list(self.METRICS),
+                'countries': sorted(COUNTRIES),
+                'sources': [],
+            }
+            self.save_meta()
 
-        except:
-            return False
+        self.slots = self.meta['slots']
+        self.frame_size = self.slots * len(self.METRICS)
+        self.codes = {code: slot for slot,
+                      code in enumerate(self.meta['countries'])}
+        self.source_ids = {source: i for i,
+                           source in enumerate(self.meta['sources'])}
 
-    def save_to_redis(self):
+        self.views = None
+        self.repair()
+
+    def filename(self, name):
+        return os.path.join(self.path, name)
+
+    def save_meta(self):
+
+        tmp = self.filename('meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, self.filename('meta.json'))
+
+    def repair(self):
         '''
-        Save JSON dump into Redis storage
+        Drop partially written frames left by an interrupted append.
+        timestamps.bin is written last, so it defines the number of complete snapshots
         '''
+        length = self.size('timestamps.bin', 8)
+
+        for name, frame_bytes in (('values.bin', self.frame_size * 8), ('sources.bin', self.slots * 2)):
+            try:
+                with open(self.filename(name), 'ab') as f:
+                    if f.tell() > length * frame_bytes:
+                        f.truncate(length * frame_bytes)
+            except OSError as e:
+                print('! Unable to repair history file', name, e)
+
+    def size(self, name, item_size):
         try:
-            r = redis.Redis()
-            return r.set('covid_data', json.dumps(self.covid_data, ensure_ascii=False))
-        except:
-            return False
+            return os.path.getsize(self.filename(name)) // item_size
+        except OSError:
+            return 0
 
-    def parse_num(self, text=None):
+    def __len__(self):
+        return self.size('timestamps.bin', 8)
+
+    def slot(self, code):
         '''
-        Format numeric data from Worldometer
-        Return 0 or a valid number
+        Return slot of the country code, allocating a new one if needed
         '''
-        if type(text) is int:
-            return text
-
-        text = text.strip().replace(',', '')
-        if len(text):
-            try:
-                return int(text)
-            except:
-                return 0
-        return 0
+        if code not in self.codes:
+            if len(self.codes) >= self.slots:
+                raise ValueError('No free history slots for ' + code)
+            self.codes[code] = len(self.meta['countries'])
+            self.meta['countries'].append(code)
 
+        return self.codes[code]
 
-def update_covid19_data(event=None, context=None):
+    def source_id(self, source):
+        if source not in self.source_ids:
+            self.source_ids[source] = len(self.meta['sources'])
+            self.meta['sources'].append(source)
 
-    cdf = CovidDataFactory()
-    cdf.execute()
+        return self.source_ids[source]
+
+    def append(self, covid_data, timestamp=None):
+        '''
+        Append a snapshot of merged COVID-19 data
+        '''
+        self.append_many([(timestamp or int(time.time()), covid_data)])
+
+    def append_many(self, snapshots):
+        '''
+        Append a batch of (timestamp, covid_data) snapshots with a single write per file
+        '''
+        known = (len(self.codes), len(self.source_ids))
+
+        values = array('q')
+        sources = array('H')
+        timestamps = array('q')
+
+        for timestamp, covid_data in snapshots:
+            frame = array('q', [self.MISSING]) * self.frame_size
+            frame_sources = array('H', [self.NO_SOURCE]) * self.slots
+
+            for code, data in covid_data.items():
+                slot = self.slot(code)
+                offset = slot * len(self.METRICS)
+
+                for i, metric in enumerate(self.METRICS):
+                    frame[offset + i] = data[metric]
+
+                frame_sources[slot] = self.source_id(data.get('source') or '')
+
+            values.extend(frame)
+            sources.extend(frame_sources)
+            timestamps.append(int(timestamp))
+
+        if (len(self.codes), len(self.source_ids)) != known:
+            self.save_meta()
+
+        for name, data in (('values.bin', values), ('sources.bin', sources), ('timestamps.bin', timestamps)):
+            with open(self.filename(name), 'ab') as f:
+                data.tofile(f)
+
+        self.views = None
+
+    def mapped(self):
+        '''
+        Return memory-mapped (timestamps, values, sources) memoryviews of the store.
+        Views are refreshed after every append
+        '''
+        length = len(self)
+
+        if self.views is None or len(self.views[0]) != length:
+            views = []
+            for name, fmt, item_size in (('timestamps.bin', 'q', 8), ('values.bin', 'q', 8), ('sources.bin', 'H', 2)):
+                if not length:
+                    views.append(memoryview(array(fmt)))
+                    continue
+
+                per_snapshot = {'timestamps.bin': 1, 'values.bin': self.frame_size,
+                                'sources.bin': self.slots}[name]
+
+                with open(self.filename(name), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), length * per_snapshot *
+                                   item_size, access=mmap.ACCESS_READ)
+
+                views.append(memoryview(mm).cast(fmt))
+
+            self.views = tuple(views)
+
+        return self.views
+
+    def timestamps(self):
+        return self.mapped()[0]
+
+    def index(self, timestamp):
+        '''
+        Return index of the latest snapshot taken at or before the timestamp
+        '''
+        i = bisect.bisect_right(self.timestamps(), timestamp) - 1
+        if i < 0:
+            raise IndexError('No snapshots before {0}'.format(timestamp))
+        return i
+
+    def series(self, code, metric='confirmed'):
+        '''
+        Return a zero-copy view of the country metric over all snapshots
+        '''
+        offset = self.codes[code] * len(self.METRICS) + \
+            self.METRICS.index(metric)
+        return self.mapped()[1][offset::self.frame_size]
+
+    def frame(self, index):
+        '''
+        Return a zero-copy view of the whole world values at the snapshot index
+        (slots x metrics, in the order of self.meta['countries'])
+        '''
+        values = self.mapped()[1]
+        return values[index * self.frame_size:(index + 1) * self.frame_size]
+
+    def snapshot(self, index):
+        '''
+        Return COVID-19 data dictionary of the snapshot index
+        '''
+        values = self.frame(index)
+        sources = self.mapped()[2][index * self.slots:(index + 1) * self.slots]
+
+        data = {}
+        for code, slot in self.codes.items():
+            offset = slot * len(self.METRICS)
+            if values[offset] == self.MISSING:
+                continue
+
+            data[code] = {metric: values[offset + i]
+                          for i, metric in enumerate(self.METRICS)}
+            data[code]['source'] = self.meta['sources'][sources[slot]
+                                                        ] if sources[slot] != self.NO_SOURCE else ''
+
+        return data
+
+    def to_array(self):
+        '''
+        Return (snapshots x slots x metrics) numpy view of the store values
+        '''
+        import numpy as np
+
+        return np.frombuffer(self.mapped()[1], dtype=np.int64).reshape(len(self), self.slots, len(self.METRICS))
+
+    def daily(self, metric='confirmed'):
+        '''
+        Return (days, values) numpy arrays with the latest snapshot of every UTC day,
+        values is a (days x slots) array of the metric, missing values are NaN
+        '''
+        import numpy as np
+
+        if not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.slots))
+
+        timestamps = np.frombuffer(self.timestamps(), dtype=np.int64)
+        days = timestamps // 86400
+
+        # Index of the latest snapshot of each day
+        last = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+
+        values = self.to_array()[last, :, self.METRICS.index(metric)].astype(
+            np.float64)
+        values[values == self.MISSING] = np.nan
+
+        return days[last] * 86400, values
+
+    def daily_deltas(self, metric='confirmed'):
+        '''
+        Return (days, deltas) with day over day change of the metric per slot
+        '''
+        import numpy as np
+
+        days, values = self.daily(metric)
+        return days[1:], np.diff(values, axis=0)
+
+    def rolling_average(self, metric='confirmed', window=7):
+        '''
+        Return (days, averages) with rolling average of daily deltas of the metric per slot
+        '''
+        import numpy as np
+
+        days, deltas = self.daily_deltas(metric)
+        if len(deltas) < window:
+            return days[:0], deltas[:0]
+
+        sums = np.cumsum(np.nan_to_num(deltas), axis=0)
+        sums = np.vstack([np.zeros((1, sums.shape[1])), sums])
+
+        return days[window - 1:], (sums[window:] - sums[:-window]) / window
+
+
+class PublishState(object):
+    '''
+    Local state of the publisher: content hash and data of the last published snapshot per target
+    along with the validator state (see SnapshotValidator.state).
+    Kept in a JSON file per target inside PUBLISH_STATE_DIR
+    '''
+
+    def __init__(self, path=PUBLISH_STATE_DIR):
+
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def filename(self, target):
+        return os.path.join(self.path, '{0}.json'.format(target))
+
+    def load(self, target):
+        '''
+        Return {'hash': ..., 'data': ..., 'validation': ...} of the last published snapshot or None
+        '''
+        try:
+            with open(self.filename(target), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, target, content_hash, data, validation=None):
+
+        state = {'hash': content_hash, 'data': data}
+        if validation is not None:
+            state['validation'] = validation
+
+        self.write(target, state)
+
+    def save_validation(self, target, validation):
+        '''
+        Update the validator state only, it is saved on every run as long as the upload may be skipped
+        '''
+        state = self.load(target) or {'hash': None, 'data': None}
+        state['validation'] = validation
+
+        self.write(target, state)
+
+    def write(self, target, state):
+
+        tmp = self.filename(target) + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp, self.filename(target))
+        except OSError as e:
+            print('! Unable to save publish state of', target, e)
+
+
+class RunMetrics(object):
+    '''
+    Timed spans and counters of a single run, exported into METRICS_DIR after the run:
+    * covid19.prom — Prometheus textfile with the values of the last run
+    * runs.jsonl — a JSON record per run
+
+    Spans and counters are labelled with keyword arguments (stage, source, host, target...).
+    A disabled instance returns a shared no-op context from span() and ignores counters,
+    so the instrumentation costs a method call per stage when metrics are off
+    '''
+
+    NO_SPAN = nullcontext()
+
+    def __init__(self, path=METRICS_DIR, enabled=True, pipeline=None):
+
+        self.path = path
+        self.enabled = enabled
+        self.pipeline = pipeline
+        self.lock = threading.Lock()
+
+        if self.enabled and self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+        self.start()
+
+    def start(self):
+        '''
+        Reset the values and start a new run
+        '''
+        self.run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+        self.started = time.time()
+        self.clock = time.monotonic()
+        self.spans = {}
+        self.counters = Counter()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def span(self, stage, **labels):
+        '''
+        Context manager timing a stage, durations of repeated spans are summed up
+        '''
+        if not self.enabled:
+            return self.NO_SPAN
+
+        return self.timer(self.key(stage, labels))
+
+    @contextmanager
+    def timer(self, key):
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.spans[key] = self.spans.get(key, 0) + elapsed
+
+    def count(self, name, value=1, **labels):
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[self.key(name, labels)] += value
+
+    def meta(self, sources):
+        '''
+        Small block describing the run to be embedded into published data
+        '''
+        return {
+            'run': self.run,
+            'generated': datetime.now(timezone.utc).strftime("%Y/%m/%d, %H:%M:%S"),
+            'sources': sources,
+        }
+
+    def record(self, result):
+        '''
+        JSON record of the run
+        '''
+        with self.lock:
+            spans, counters = dict(self.spans), dict(self.counters)
+
+        record = {
+            'run': self.run,
+            'started': self.started,
+            'duration': round(time.monotonic() - self.clock, 6),
+            'result': bool(result),
+            'spans': [dict(labels, stage=stage, seconds=round(seconds, 6))
+                      for (stage, labels), seconds in sorted(spans.items())],
+            'counters': [dict(labels, name=name, value=value)
+                         for (name, labels), value in sorted(counters.items())],
+        }
+
+        if self.pipeline:
+            record['pipeline'] = self.pipeline
+
+        return record
+
+    def labels(self, labels):
+
+        if self.pipeline:
+            labels = [('pipeline', self.pipeline)] + list(labels)
+
+        if not labels:
+            return ''
+
+        return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in labels) + '}'
+
+    def textfile(self, record):
+        '''
+        Render the record in Prometheus text exposition format
+        '''
+        lines = [
+            '# HELP covid19_run_timestamp_seconds Start time of the last run',
+            '# TYPE covid19_run_timestamp_seconds gauge',
+            'covid19_run_timestamp_seconds{0} {1:.3f}'.format(self.labels(()), record['started']),
+            '# HELP covid19_run_duration_seconds Duration of the last run',
+            '# TYPE covid19_run_duration_seconds gauge',
+            'covid19_run_duration_seconds{0} {1:.6f}'.format(self.labels(()), record['duration']),
+            '# HELP covid19_run_success Whether the last run has published the data',
+            '# TYPE covid19_run_success gauge',
+            'covid19_run_success{0} {1:d}'.format(self.labels(()), record['result']),
+            '# HELP covid19_stage_duration_seconds Duration of a stage of the last run',
+            '# TYPE covid19_stage_duration_seconds gauge',
+        ]
+
+        for span in record['spans']:
+            labels = sorted((name, value) for name, value in span.items() if name != 'seconds')
+            lines.append('covid19_stage_duration_seconds{0} {1:.6f}'.format(
+                self.labels(labels), span['seconds']))
+
+        names = []
+        values = {}
+        for counter in record['counters']:
+            if counter['name'] not in values:
+                names.append(counter['name'])
+                values[counter['name']] = []
+            labels = sorted((name, value) for name, value in counter.items()
+                            if name not in ('name', 'value'))
+            values[counter['name']].append((labels, counter['value']))
+
+        for name in names:
+            lines.append('# TYPE covid19_{0} gauge'.format(name))
+            for labels, value in values[name]:
+                lines.append('covid19_{0}{1} {2}'.format(
+                    name, self.labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, result):
+        '''
+        Write the Prometheus textfile and append the JSON record of the run
+        '''
+        if not self.enabled or not self.path:
+            return
+
+        record = self.record(result)
+
+        try:
+            filename = os.path.join(self.path, 'covid19-{0}.prom'.format(
+                self.pipeline) if self.pipeline else 'covid19.prom')
+            with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(self.textfile(record))
+            os.replace(filename + '.tmp', filename)
+
+            with open(os.path.join(self.path, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        except OSError as e:
+            print('! Unable to export run metrics:', e)
+
+
+class SourceStore(object):
+    '''
+    Last known good parsed data of every source kept in a SQLite database,
+    so a failed or late source can be replaced by its previous data
+    '''
+
+    def __init__(self, path=SOURCE_STORE_PATH):
+
+        self.path = path
+        self.lock = threading.Lock()
+
+        with self.connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, fetched REAL NOT NULL, data TEXT NOT NULL)')
+
+    @contextmanager
+    def connect(self):
+
+        with self.lock, closing(sqlite3.connect(self.path, timeout=10)) as db:
+            with db:
+                yield db
+
+    def save(self, name, data, fetched=None):
+
+        try:
+            body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+            with self.connect() as db:
+                db.execute('INSERT OR REPLACE INTO sources (name, fetched, data) VALUES (?, ?, ?)',
+                           (name, fetched or time.time(), body))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print('! Unable to store the data of', name, e)
+
+    def load(self, name, ttl):
+        '''
+        Return (data, fetched timestamp) of the source if it is not older than ttl seconds, (None, None) otherwise
+        '''
+        try:
+            with self.connect() as db:
+                row = db.execute('SELECT fetched, data FROM sources WHERE name = ? AND fetched >= ?',
+                                 (name, time.time() - ttl)).fetchone()
+        except sqlite3.Error as e:
+            print('! Unable to load the data of', name, e)
+            return None, None
+
+        if row is None:
+            return None, None
+
+        return json.loads(row[1]), row[0]
+
+
+def serialize_snapshot(covid_data, meta=None):
+    '''
+    Canonical JSON serialization of COVID-19 data
+    An optional meta block is embedded as _meta key but does not affect the content hash
+    Return (body bytes, content hash)
+    '''
+    body = json.dumps(covid_data, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+    body_hash = hashlib.sha256(body).hexdigest()
+
+    if meta:
+        body = json.dumps(dict(covid_data, _meta=meta), ensure_ascii=False, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+
+    return body, body_hash
+
+
+def snapshot_delta(previous, current, previous_hash=None, current_hash=None, stale=None):
+    '''
+    Build a delta document listing only the countries changed since the previous snapshot.
+    If the previous snapshot is unknown all the countries are listed and 'full' is set.
+    Sources replaced by their last known good data are listed under 'stale' with the time they were fetched
+    '''
+    if previous is None:
+        changed = current
+        removed = []
+    else:
+        changed = {code: data for code, data in current.items()
+                   if previous.get(code) != data}
+        removed = sorted(code for code in previous if code not in current)
+
+    return {
+        'hash': current_hash,
+        'previous': previous_hash,
+        'full': previous is None,
+        'updated': datetime.now(timezone.utc).strftime("%Y/%m/%d, %H:%M:%S"),
+        'changed': changed,
+        'removed': removed,
+        'stale': stale or {},
+    }
+
+
+def render_artifacts(covid_data, body, delta, artifacts=ARTIFACTS):
+    '''
+    Render all output formats of a snapshot in one pass over the countries:
+    canonical JSON (as is and gzip-compressed), compact CSV, columnar JSON,
+    delta document and a small JSON object per changed country
+
+    Return a list of artifacts dictionaries with key, body and HTTP headers
+    '''
+    columns = {'codes': [], 'confirmed': [], 'deaths': [],
+               'recovered': [], 'latest_update': [], 'source': []}
+    countries = []
+
+    csv_body = StringIO()
+    csv_writer = csv.writer(csv_body, lineterminator='\n')
+    csv_writer.writerow(
+        ('code', 'confirmed', 'deaths', 'recovered', 'latest_update', 'source'))
+
+    for code in sorted(covid_data):
+        data = covid_data[code]
+        row = (code, data['confirmed'], data['deaths'],
+               data['recovered'], data['latest_update'], data['source'])
+
+        csv_writer.writerow(row)
+        for column, value in zip(columns, row):
+            columns[column].append(value)
+
+        if code in delta['changed']:
+            countries.append(('country', code, json.dumps(
+                data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')))
+
+    bodies = [
+        ('map', None, body),
+        ('map_gzip', None, body),
+        ('csv', None, csv_body.getvalue().encode('utf-8')),
+        ('columns', None, json.dumps(columns, ensure_ascii=False,
+                                      separators=(',', ':')).encode('utf-8')),
+        ('delta', None, json.dumps(delta, ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8')),
+    ] + countries
+
+    rendered = []
+
+    for name, code, content in bodies:
+        key, content_type, cache_control = artifacts[name]
+        artifact = {
+            'key': key.format(code),
+            'body': content,
+            'content_type': content_type,
+            'cache_control': cache_control,
+            'content_encoding': None,
+        }
+
+        if name == 'map_gzip' or (name != 'map' and len(content) > GZIP_MIN_SIZE):
+            artifact['body'] = gzip.compress(content, mtime=0)
+            artifact['content_encoding'] = 'gzip'
+
+        rendered.append(artifact)
+
+    return rendered
+
+
+class CountryRecord(object):
+    '''
+    Compact merged COVID-19 data record of a country
+    '''
+
+    __slots__ = ('code', 'confirmed', 'deaths', 'recovered',
+                 'latest_update', 'source', 'provinces')
+
+    METRICS = ('confirmed', 'deaths', 'recovered')
+
+    def __init__(self, code, confirmed=0, deaths=0, recovered=0, latest_update='', source='', provinces=None):
+
+        self.code = code
+        self.confirmed = confirmed
+        self.deaths = deaths
+        self.recovered = recovered
+        self.latest_update = latest_update
+        self.source = source
+        self.provinces = provinces
+
+    def to_dict(self):
+
+        data = {
+            'code': self.code,
+            'confirmed': self.confirmed,
+            'deaths': self.deaths,
+            'recovered': self.recovered,
+            'latest_update': self.latest_update,
+            'source': self.source,
+        }
+
+        if self.provinces is not None:
+            data['provinces'] = self.provinces
+
+        return data
+
+
+class MergeEngine(object):
+    '''
+    Combines data sources in a single pass over the union of country codes following MERGE_POLICY.
+    merge() returns merged CountryRecord objects and a structured diff of what each source contributed:
+    {source: {code: {metric: (previous value or None, new value)}}}
+    '''
+
+    RULES = ('base', 'max', 'override')
+
+    def __init__(self, policy=MERGE_POLICY):
+
+        self.policy = {}
+
+        for code, steps in policy.items():
+            self.policy[code] = []
+
+            for source, rules in steps:
+                if isinstance(rules, str):
+                    rules = {metric: rules for metric in CountryRecord.METRICS}
+
+                for metric, rule in rules.items():
+                    if metric not in CountryRecord.METRICS or rule not in self.RULES:
+                        raise ValueError('Wrong merge rule {0} for {1} of {2}'.format(
+                            rule, metric, source))
+
+                self.policy[code].append((source, tuple(rules.items())))
+
+        self.default = self.policy.pop('default')
+
+    def merge(self, sources):
+
+        records = {}
+        diff = {source: {} for source in sources}
+
+        codes = {}
+        for data in sources.values():
+            codes.update(dict.fromkeys(data))
+
+        for code in codes:
+            record = None
+
+            for source, rules in self.policy.get(code, self.default):
+                obj = sources.get(source, {}).get(code)
+                if obj is None:
+                    continue
+
+                if record is None:
+                    record = CountryRecord(code, obj['confirmed'], obj['deaths'], obj['recovered'],
+                                           obj['latest_update'], obj['source'], obj.get('provinces'))
+                    diff[source][code] = {metric: (None, obj[metric])
+                                          for metric in CountryRecord.METRICS}
+                    continue
+
+                changes = {}
+                for metric, rule in rules:
+                    current = getattr(record, metric)
+                    value = obj[metric]
+
+                    if rule == 'override' or (rule == 'max' and value > current):
+                        setattr(record, metric, value)
+                        changes[metric] = (current, value)
+
+                if changes:
+                    record.latest_update = obj['latest_update']
+                    record.source = obj['source']
+                    diff[source][code] = changes
+
+                # Province level detail is kept unless the record is overridden by a source without it
+                if 'provinces' in obj:
+                    record.provinces = obj['provinces']
+                elif len(changes) == len(CountryRecord.METRICS) and all(rule == 'override' for _, rule in rules):
+                    record.provinces = None
+
+            if record is not None:
+                records[code] = record
+
+        return records, diff
+
+
+class SnapshotValidator(object):
+    '''
+    Incremental validator of merged data against the last accepted snapshot kept in memory.
+    Revision counters and source history survive process restarts through state()/restore().
+    Rules (see VALIDATION_* settings) are reported as a bit mask per record:
+    EMPTY, NEGATIVE and SUM check a record itself, BACKWARDS and JUMP compare it with its previous values
+    and FLAPPING tracks changes of its source.
+
+    Large batches (provinces, histories) are checked with vectorized numpy expressions
+    '''
+
+    EMPTY = 1
+    NEGATIVE = 2
+    SUM = 4
+    BACKWARDS = 8
+    JUMP = 16
+    FLAPPING = 32
+
+    # Records breaking these rules are never accepted as a revision
+    INVALID = EMPTY | NEGATIVE | SUM
+
+    REASONS = ((EMPTY, 'empty'), (NEGATIVE, 'negative'), (SUM, 'deaths and recovered exceed confirmed'),
+               (BACKWARDS, 'count went backwards'), (JUMP, 'count jumped'), (FLAPPING, 'source is flapping'))
+
+    METRICS = CountryRecord.METRICS
+
+    def __init__(self, previous=None):
+
+        self.previous = previous or {}
+        self.sources = {}
+        self.pending = {}
+
+    @classmethod
+    def describe(cls, mask):
+        return [reason for rule, reason in cls.REASONS if mask & rule]
+
+    def state(self):
+        '''
+        Return JSON serializable revision counters and source history of the countries
+        '''
+        return {
+            'pending': {code: [data, runs] for code, (data, runs) in self.pending.items()},
+            'sources': {code: list(sources) for code, sources in self.sources.items()},
+        }
+
+    def restore(self, state):
+        '''
+        Load the state saved by state()
+        '''
+        state = state or {}
+
+        self.pending = {code: (data, runs) for code,
+                        (data, runs) in state.get('pending', {}).items()}
+        self.sources = {code: deque(sources, maxlen=VALIDATION_FLAP_WINDOW)
+                        for code, sources in state.get('sources', {}).items()}
+
+    def check(self, values, previous=None):
+        '''
+        Check (confirmed, deaths, recovered) values against the previous ones
+        Return a mask of broken rules
+        '''
+        confirmed, deaths, recovered = values
+        mask = 0
+
+        if not (confirmed > 0 or deaths > 0 or recovered > 0):
+            mask |= self.EMPTY
+        if min(values) < 0:
+            mask |= self.NEGATIVE
+        if confirmed < deaths + recovered:
+            mask |= self.SUM
+
+        if previous:
+            for value, before in zip(values, previous):
+                if value < before * (1 - VALIDATION_MAX_DECREASE):
+                    mask |= self.BACKWARDS
+                if before >= VALIDATION_JUMP_BASE and value > before * VALIDATION_MAX_JUMP:
+                    mask |= self.JUMP
+
+        return mask
+
+    def check_arrays(self, values, previous=None, rules=EMPTY | NEGATIVE | SUM | BACKWARDS | JUMP):
+        '''
+        Vectorized check of (rows x metrics) values against previous ones (negative if unknown)
+        Return an array with a mask of broken rules per row
+        '''
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.int64)
+        confirmed, deaths, recovered = values[:, 0], values[:, 1], values[:, 2]
+
+        mask = np.where((values <= 0).all(axis=1), self.EMPTY, 0)
+        mask |= np.where((values < 0).any(axis=1), self.NEGATIVE, 0)
+        mask |= np.where(confirmed < deaths + recovered, self.SUM, 0)
+
+        if previous is not None:
+            previous = np.asarray(previous, dtype=np.float64)
+            known = previous >= 0
+
+            backwards = known & (values < previous * (1 - VALIDATION_MAX_DECREASE))
+            jump = known & (previous >= VALIDATION_JUMP_BASE) & (
+                values > previous * VALIDATION_MAX_JUMP)
+
+            mask |= np.where(backwards.any(axis=1), self.BACKWARDS, 0)
+            mask |= np.where(jump.any(axis=1), self.JUMP, 0)
+
+        return mask & rules
+
+    def check_provinces(self, provinces):
+        '''
+        Check Province/State totals of a country for negative values
+        '''
+        values = [tuple(totals[metric] for metric in self.METRICS)
+                  for totals in provinces.values()]
+
+        if len(values) >= VALIDATION_VECTOR_MIN:
+            return int(self.check_arrays(values, rules=self.NEGATIVE).max())
+
+        return self.NEGATIVE if any(min(row) < 0 for row in values) else 0
+
+    def flapping(self, code, source):
+        '''
+        Track source of a changed country record, return FLAPPING if it changes too often
+        '''
+        sources = self.sources.get(code)
+        if sources is None:
+            sources = self.sources[code] = deque(maxlen=VALIDATION_FLAP_WINDOW)
+
+        sources.append(source)
+        changes = sum(a != b for a, b in zip(sources, list(sources)[1:]))
+
+        return self.FLAPPING if changes > VALIDATION_FLAP_LIMIT else 0
+
+    def revision(self, code, data):
+        '''
+        Count runs a quarantined record arrives unchanged, return True once it should be accepted
+        '''
+        pending, runs = self.pending.get(code, (None, 0))
+        runs = runs + 1 if pending == data else 1
+
+        if runs >= VALIDATION_QUARANTINE_RUNS:
+            self.pending.pop(code, None)
+            return True
+
+        self.pending[code] = (data, runs)
+        return False
+
+    def validate(self, covid_data):
+        '''
+        Check the countries changed since the last accepted snapshot.
+        Quarantined countries keep their last accepted data (or are dropped if there is none)
+
+        Return (validated data, {code: [reasons]} of quarantined countries)
+        '''
+        changed = [code for code, data in covid_data.items()
+                   if self.previous.get(code) != data]
+
+        values = [tuple(covid_data[code][metric] for metric in self.METRICS)
+                  for code in changed]
+        previous = [tuple(self.previous[code][metric] for metric in self.METRICS)
+                    if code in self.previous else None for code in changed]
+
+        if len(changed) >= VALIDATION_VECTOR_MIN:
+            masks = self.check_arrays(values, [row or (-1, -1, -1) for row in previous]).tolist()
+        else:
+            masks = [self.check(row, before)
+                     for row, before in zip(values, previous)]
+
+        quarantined = {}
+
+        for code, mask in zip(changed, masks):
+            data = covid_data[code]
+
+            mask |= self.flapping(code, data.get('source'))
+            if data.get('provinces'):
+                mask |= self.check_provinces(data['provinces'])
+
+            if not mask:
+                self.pending.pop(code, None)
+            elif not mask & self.INVALID and self.revision(code, data):
+                print('! {0} is accepted as a revision: {1}'.format(code, ', '.join(self.describe(mask))))
+            else:
+                quarantined[code] = self.describe(mask)
+
+        validated = {}
+        for code, data in covid_data.items():
+            if code not in quarantined:
+                validated[code] = data
+            elif code in self.previous:
+                validated[code] = self.previous[code]
+
+        return validated, quarantined
+
+    def accept(self, covid_data):
+        '''
+        Keep the published data as the previous snapshot of the next validation
+        '''
+        self.previous = covid_data
+
+    def validate_history(self, history):
+        '''
+        Check every snapshot of the history store against the preceding one
+        Return a list of (timestamp, code, [reasons])
+        '''
+        import numpy as np
+
+        if len(history) < 2:
+            return []
+
+        values = history.to_array()
+        current = values[1:].reshape(-1, len(history.METRICS))
+        previous = values[:-1].reshape(-1, len(history.METRICS))
+
+        masks = self.check_arrays(current, previous)
+        masks[(current == history.MISSING).any(axis=1)] = 0
+
+        timestamps = history.timestamps()
+        countries = history.meta['countries']
+
+        return [(timestamps[1 + row // history.slots], countries[row % history.slots], self.describe(int(masks[row])))
+                for row in np.flatnonzero(masks)]
+
+
+class ApiServer(object):
+    '''
+    Embedded read API serving the latest merged data from memory:
+    * /countries — all the countries
+    * /countries/{ISO3} — a single country
+    * /countries/{ISO3}/history — time series of a country (if the history store of the factory is given)
+    * /top/{confirmed|deaths|recovered}[/{N}] — top N countries by the metric (N is one of API_TOP_SIZES, 10 by default)
+
+    Whole HTTP responses (plain and gzip-compressed, with strong ETags and 304 variants)
+    are rendered on publish(), so serving a request is a dictionary lookup and a socket write
+    '''
+
+    MAX_BODY = 65536
+
+    STATUS = {
+        200: 'OK',
+        304: 'Not Modified',
+        400: 'Bad Request',
+        404: 'Not Found',
+        405: 'Method Not Allowed',
+        503: 'Service Unavailable',
+    }
+
+    def __init__(self, history=None):
+
+        self.responses = {}
+        self.history = history
+        self.history_responses = {}
+
+        self.errors = {status: self.render(status, json.dumps({'error': self.STATUS[status]}).encode('utf-8'))
+                       for status in (400, 404, 405, 503)}
+
+    def render(self, status, body, etag=None, encoding=None, cache_control='no-cache'):
+        '''
+        Render HTTP response bytes
+        '''
+        lines = ['HTTP/1.1 {0} {1}'.format(status, self.STATUS[status])]
+
+        if status != 304:
+            lines.append('Content-Type: application/json; charset=utf-8')
+            lines.append('Content-Length: {0}'.format(len(body)))
+
+        if encoding:
+            lines.append('Content-Encoding: ' + encoding)
+
+        if etag:
+            lines.append('ETag: ' + etag)
+            lines.append('Vary: Accept-Encoding')
+
+        lines.append('Cache-Control: ' + cache_control)
+
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body if status != 304 else b'')
+
+    def response(self, data, cache_control='max-age=60'):
+        '''
+        Pre-render plain and gzip responses of the data
+        Return {encoding: (etag, 200 response, length of 200 response headers, 304 response)}
+        '''
+        body = json.dumps(data, ensure_ascii=False, sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+
+        variants = {}
+        for encoding, content, tag in ((None, body, '"{0}"'.format(etag)), ('gzip', gzip.compress(body, mtime=0), '"{0}-gzip"'.format(etag))):
+            full = self.render(200, content, tag, encoding, cache_control)
+            variants[encoding] = (tag, full, len(full) - len(content),
+                                  self.render(304, b'', tag, encoding, cache_control))
+
+        return variants
+
+    def publish(self, covid_data):
+        '''
+        Render all the responses of a new snapshot and swap them in at once
+        '''
+        responses = {
+            '/countries': self.response(covid_data),
+        }
+
+        for code, data in covid_data.items():
+            responses['/countries/' + code] = self.response(data)
+
+        for metric in CountryRecord.METRICS:
+            ranked = sorted(covid_data.values(),
+                            key=lambda data: data[metric], reverse=True)
+
+            for size in API_TOP_SIZES:
+                responses['/top/{0}/{1}'.format(metric, size)
+                          ] = self.response(ranked[:size])
+
+            responses['/top/' + metric] = responses['/top/{0}/10'.format(metric)]
+
+        self.responses, self.history_responses = responses, {}
+
+    def history_response(self, code):
+        '''
+        Render history response of a country once per snapshot
+        '''
+        if code not in self.history_responses:
+            if self.history is None or code not in self.history.codes:
+                return None
+
+            data = {'code': code, 'timestamps': list(
+                self.history.timestamps())}
+            for metric in HistoryStore.METRICS:
+                data[metric] = [value if value != HistoryStore.MISSING else None
+                                for value in self.history.series(code, metric)]
+
+            self.history_responses[code] = self.response(data)
+
+        return self.history_responses[code]
+
+    def route(self, path):
+
+        parts = path.strip('/').split('/')
+
+        # Country codes are case-insensitive
+        if len(parts) > 1 and parts[0] == 'countries':
+            parts[1] = parts[1].upper()
+
+        if len(parts) == 3 and parts[0] == 'countries' and parts[2] == 'history':
+            return self.history_response(parts[1])
+
+        return self.responses.get('/' + '/'.join(parts))
+
+    async def handle(self, reader, writer):
+        '''
+        Serve HTTP/1.1 requests of a connection (keep-alive is supported)
+        '''
+        import asyncio
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(self.errors[400])
+                    break
+
+                close = version != 'HTTP/1.1' or headers.get(
+                    'connection', '').lower() == 'close'
+
+                # Request bodies are discarded to keep the connection in sync,
+                # chunked and large ones are not read, the connection is closed after the response instead
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    writer.write(self.errors[400])
+                    break
+
+                if 'transfer-encoding' in headers or not 0 <= length <= self.MAX_BODY:
+                    close = True
+                elif length:
+                    await reader.readexactly(length)
+
+                if method not in ('GET', 'HEAD'):
+                    writer.write(self.errors[405])
+                elif not self.responses:
+                    writer.write(self.errors[503])
+                else:
+                    response = self.route(target.partition('?')[0].rstrip('/'))
+
+                    if response is None:
+                        writer.write(self.errors[404])
+                    else:
+                        encoding = 'gzip' if 'gzip' in headers.get(
+                            'accept-encoding', '') else None
+                        etag, full, header_length, not_modified = response[encoding]
+
+                        if etag in headers.get('if-none-match', ''):
+                            writer.write(not_modified)
+                        elif method == 'HEAD':
+                            writer.write(full[:header_length])
+                        else:
+                            writer.write(full)
+
+                if close:
+                    break
+
+                await writer.drain()
+
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def serve(self, host=None, port=None):
+        import asyncio
+
+        server = await asyncio.start_server(self.handle, host or API_HOST, port or API_PORT)
+        print('Serving API on', ', '.join(str(sock.getsockname())
+                                          for sock in server.sockets))
+
+        async with server:
+            await server.serve_forever()
+
+
+class CovidDataFactory(object):
+
+    def __init__(self, config=None, transport=None):
+
+        self.config = config = config or PipelineConfig()
+        self.resolver = config.resolver()
+
+        self.covid_data = {}  # App Data Storage
+        self.validated = False  # Whether the data of the last run has passed validation
+        self.merge_diff = {}
+        self.merger = MergeEngine(config.merge_policy)
+        self.validator = SnapshotValidator()
+        self.quarantined = {}
+        self.cache = None
+
+        # Connections are kept warm between runs in daemon mode.
+        # Any object with requests.Session compatible get() may be used as a transport (e.g. recorded fixtures)
+        self.http = transport or requests.Session()
+        self.s3 = None
+        self.redis = None
+
+        self.publish_state = None
+
+        if PUBLISH_STATE_DIR:
+            try:
+                self.publish_state = PublishState(
+                    config.state_path(PUBLISH_STATE_DIR))
+            except OSError as e:
+                print('! Publish state is disabled:', e)
+
+        self.metrics = RunMetrics(enabled=False)
+
+        if METRICS_DIR or METRICS_META:
+            try:
+                self.metrics = RunMetrics(
+                    pipeline=None if config.default else config.name)
+            except OSError as e:
+                print('! Run metrics are disabled:', e)
+
+        self.source_rows = {}
+        self.stale_sources = {}
+        self.source_store = None
+
+        if SOURCE_STORE_PATH:
+            try:
+                self.source_store = SourceStore(SOURCE_STORE_PATH)
+            except (OSError, sqlite3.Error) as e:
+                print('! Source store is disabled:', e)
+
+        self.resolver_calls = self.resolver.calls()
+
+        self.history = None
+
+        if config.history_dir:
+            try:
+                self.history = HistoryStore(config.history_dir)
+            except (OSError, ValueError) as e:
+                print('! History store is disabled:', e)
+
+        if FETCH_CACHE_DIR:
+            try:
+                self.cache = FetchCache(config.state_path(
+                    FETCH_CACHE_DIR), options=config.parse_key())
+            except OSError as e:
+                print('! Fetch cache is disabled:', e)
+
+    def execute(self, shared=None, shared_stale=None):
+        '''
+        Fetch, combine, validate and publish the data.
+        Sources already fetched by another factory may be given as shared with their stale_sources (see PipelineRunner)
+        '''
+
+        print('\nSTART\n')
+
+        metrics = self.metrics
+        metrics.start()
+        result = False
+        self.validated = False
+
+        try:
+            if shared is None:
+                sources = self.fetch_sources()
+            else:
+                sources = shared
+                self.stale_sources = dict(shared_stale or {})
+
+            sources = self.select_sources(sources)
+
+            # Titles of the shared sources are resolved and counted by the fetcher
+            if shared is None:
+                self.count_resolved(self.resolver.report_misses())
+
+            with metrics.span('merge'):
+                self.combine_data(sources)
+
+            with metrics.span('validate'):
+                valid = self.validate_json()
+
+            if not valid:
+                print("COVID JSON data validation fail")
+                return result
+
+            self.validated = True
+
+            if self.history is not None:
+                try:
+                    with metrics.span('history'):
+                        self.history.append(self.covid_data)
+                except (OSError, ValueError) as e:
+                    print('! Unable to append the data to history:', e)
+
+            if self.publish_target() == 'redis':
+                print(
+                    '\nNo S3-type Storage Available.\nTrying to store data into Redis.')
+                with metrics.span('publish', target='redis'):
+                    result = self.save_to_redis()
+            else:
+                with metrics.span('publish', target='s3'):
+                    result = self.save_to_cloud()
+
+            print('Saving JSON:', 'OK' if result else 'ERROR')
+
+        finally:
+            metrics.export(result)
+
+        print('\nEND\n')
+
+        return result
+
+    def count_resolved(self, misses):
+        '''
+        Count resolved and unresolved country titles of the run per source
+        '''
+        if not self.metrics.enabled:
+            return
+
+        calls, self.resolver_calls = self.resolver_calls, self.resolver.calls()
+        unresolved = Counter()
+
+        for (title, source), rows in misses.items():
+            unresolved[source] += rows
+
+        for source, total in self.resolver_calls.items():
+            total -= calls.get(source, 0)
+            if total or unresolved[source]:
+                self.metrics.count('titles_resolved', total - unresolved[source], source=source)
+                self.metrics.count('titles_unresolved', unresolved[source], source=source)
+
+    def fetch_sources(self, readers=None):
+        '''
+        Fetch all data sources in parallel.
+        Each source has its own deadline (SOURCE_DEADLINES) bounded by the overall RUN_DEADLINE.
+        A source that fails, returns no data or misses its deadline is replaced by its last known good data
+        (see SOURCE_TTLS) and listed in stale_sources, or dropped from this run (returned as an empty dictionary).
+        Fresh data is saved as the last known good one, including late sources which complete in background.
+        Readers run on daemon threads, so a one-shot run exits right after publishing and abandons late sources,
+        their background refresh takes effect in a long-running process (--daemon, --serve) only
+
+        Returns a dictionary with data per source
+        '''
+
+        readers = readers or {
+            'arcgis': self.read_arcgis,
+            'worldometer': self.read_worldometer,
+            'csse': self.read_covid_csse,
+            'manual': self.read_manual_data,
+        }
+
+        sources = {}
+        self.stale_sources = {}
+        started = time.monotonic()
+        run_deadline = started + RUN_DEADLINE
+
+        executor = DaemonExecutor(max_workers=len(readers))
+        futures = {name: executor.submit(self.read_source, name, reader)
+                   for name, reader in readers.items()}
+
+        try:
+            for name, future in futures.items():
+                deadline = min(
+                    started + SOURCE_DEADLINES[self.source_kind(name)], run_deadline)
+
+                try:
+                    sources[name] = future.result(
+                        timeout=max(deadline - time.monotonic(), 0))
+                    print('Fetched {0} in {1:.2f}s'.format(
+                        name, time.monotonic() - started))
+                except TimeoutError:
+                    print('! Source {0} missed its deadline'.format(name))
+                    sources[name] = {}
+                    future.add_done_callback(
+                        lambda future, name=name: self.refresh_source(name, future))
+                except Exception as e:
+                    print('! Source {0} failed: {1}'.format(name, e))
+                    sources[name] = {}
+
+                if sources[name]:
+                    if self.source_store:
+                        self.source_store.save(self.store_key(name), sources[name])
+                else:
+                    sources[name] = self.last_known_source(name)
+        finally:
+            # Do not wait for the sources which missed the deadline
+            executor.shutdown(cancel_futures=True)
+
+        self.source_rows = {name: len(data) for name, data in sources.items()}
+
+        for name, rows in self.source_rows.items():
+            self.metrics.count('source_rows', rows, source=name)
+
+        return sources
+
+    def last_known_source(self, name):
+        '''
+        Return last known good data of the source marking it as stale or an empty dictionary
+        '''
+        if not self.source_store:
+            return {}
+
+        data, fetched = self.source_store.load(
+            self.store_key(name), SOURCE_TTLS[self.source_kind(name)])
+
+        if not data:
+            return {}
+
+        self.stale_sources[name] = datetime.fromtimestamp(
+            fetched, timezone.utc).strftime("%Y/%m/%d, %H:%M:%S")
+        self.metrics.count('source_stale', source=name)
+        print('! Using {0} data stored at {1}'.format(name, self.stale_sources[name]))
+
+        return data
+
+    def refresh_source(self, name, future):
+        '''
+        Save data of a source which completed after its deadline as the last known good one
+        '''
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+
+        if self.source_store:
+            self.source_store.save(self.store_key(name), future.result())
+            print('Source {0} refreshed in background'.format(name))
+
+    @staticmethod
+    def source_kind(name):
+        '''
+        Sources may be named with a suffix, e.g. "manual {url}" for a spreadsheet of one of the pipelines
+        '''
+        return name.split(' ', 1)[0]
+
+    def store_key(self, name):
+        '''
+        Key of the source in the source store, manual data is kept per spreadsheet
+        '''
+        if name == 'manual' and self.config.manual_url:
+            return 'manual ' + self.config.manual_url
+
+        return name
+
+    def select_sources(self, fetched):
+        '''
+        Select countries of the configuration from fetched sources (which may be shared with other factories).
+        Fetched records are not modified: records are copied only to drop Province/State detail
+        '''
+        countries = self.config.countries
+        sources = {}
+
+        for name, data in fetched.items():
+            sources[name] = {}
+            for code, obj in data.items():
+                if code not in countries:
+                    continue
+                if 'provinces' in obj and not self.config.provinces:
+                    obj = {field: value for field, value in obj.items()
+                           if field != 'provinces'}
+                sources[name][code] = obj
+
+        self.source_rows = {name: len(data) for name, data in sources.items()}
+
+        return sources
+
+    def read_source(self, name, reader):
+
+        with self.metrics.span('fetch', source=name):
+            return reader()
+
+    def validate_json(self):
+        '''
+        Validate countries changed since the previous snapshot (see SnapshotValidator),
+        quarantined countries keep their last published data.
+        Check number of records to Save
+        '''
+        validator = self.validator
+        target = self.publish_target()
+
+        if not validator.previous:
+            _, previous = self.last_published(target)
+            validator.previous = previous or {}
+            validator.restore(self.last_validation(target))
+
+        self.covid_data, self.quarantined = validator.validate(self.covid_data)
+
+        if self.publish_state:
+            self.publish_state.save_validation(target, validator.state())
+
+        for code, reasons in sorted(self.quarantined.items()):
+            print('! {0} is quarantined: {1}'.format(code, ', '.join(reasons)))
+
+        self.metrics.count('quarantined', len(self.quarantined))
+
+        if len(self.quarantined) > len(self.covid_data) * VALIDATION_MAX_QUARANTINE:
+            print('! Too many countries quarantined:', len(self.quarantined))
+            return False
+
+        # Should be less or equal to original list of countries and at list 100
+        # items long
+        if len(self.config.countries) >= len(self.covid_data) > self.config.min_countries:
+            validator.accept(self.covid_data)
+            return True
+
+        # Invalid nuber of records
+        return False
+
+    def add_country_data(self, country_name=None, confirmed=0, deaths=0, recovered=0, latest_update=None, source=''):
+        '''
+        Normalize Country title
+        Return a dictionary with COVID-19 country data with source, latest update label and county ISO code
+        '''
+        country_code = self.resolver.resolve(
+            country_name, source) if country_name is not None else None
+
+        if country_code:
+
+            return {
+                'code': country_code,
+                'confirmed': self.parse_num(confirmed),
+                'deaths': self.parse_num(deaths),
+                'recovered': self.parse_num(recovered),
+                'latest_update': latest_update,
+                'source': source
+            }
+
+        return None
+
+    def fetch(self, url, parse, timeout=40, encoding=None, stream=False, lines=True):
+        '''
+        Conditional GET of an upstream resource through the fetch cache.
+        Sends If-None-Match/If-Modified-Since validators of the cached copy and
+        skips both the download and the parse on 304 Not Modified (or the parse alone if the body hash did not change).
+        In stream mode parse gets an iterator of body lines (or of decoded text chunks if lines is False)
+        instead of the whole text
+
+        Returns parsed data or None if the resource is not available
+        '''
+        entry = self.cache.load(url) if self.cache else None
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.http.get(
+            url, headers=headers, timeout=timeout, stream=stream)
+
+        metrics = self.metrics
+        host = urlsplit(url).hostname if metrics.enabled else None
+
+        if response.status_code == requests.codes.not_modified and entry:
+            response.close()
+            self.cache.touch(url)
+            metrics.count('fetch_requests', host=host, cache='not_modified')
+            return entry['data']
+
+        if response.status_code != requests.codes.ok:
+            response.close()
+            metrics.count('fetch_requests', host=host, cache='error')
+            return None
+
+        if encoding:
+            response.encoding = encoding
+
+        if stream:
+            metrics.count('fetch_requests', host=host, cache='miss')
+            return self.fetch_stream(url, response, parse, host, lines)
+
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        metrics.count('fetch_bytes', len(response.content), host=host)
+
+        if entry and entry.get('hash') == body_hash:
+            data = entry['data']
+            metrics.count('fetch_requests', host=host, cache='unchanged')
+        else:
+            with metrics.span('parse', host=host):
+                data = parse(response.text)
+            metrics.count('fetch_requests', host=host, cache='miss')
+
+        if self.cache:
+            self.cache.store(url, response, body_hash, data)
+
+        return data
+
+    def fetch_stream(self, url, response, parse, host=None, lines=True):
+        '''
+        Parse response body line by line (or chunk by chunk) while it is being downloaded.
+        The body is hashed and written into the fetch cache on the fly, so memory stays flat
+        '''
+        hasher = hashlib.sha256()
+        body = None
+        size = 0
+
+        if self.cache:
+            try:
+                body = self.cache.open_body(url)
+            except OSError as e:
+                print('! Unable to store fetch cache entry for', url, e)
+
+        def chunks():
+            nonlocal size
+            for chunk in response.iter_content(chunk_size=65536):
+                size += len(chunk)
+                hasher.update(chunk)
+                if body:
+                    body.write(chunk)
+                yield chunk
+
+        try:
+            if lines:
+                text = iter_text_lines(chunks(), response.encoding or 'utf-8')
+            else:
+                text = iter_text(chunks(), response.encoding or 'utf-8')
+
+            data = parse(text)
+
+            # Read the rest of the body to complete the hash and cached copy
+            for _ in text:
+                pass
+
+        except BaseException:
+            if body:
+                body.close()
+                os.remove(body.name)
+            raise
+
+        finally:
+            response.close()
+            self.metrics.count('fetch_bytes', size, host=host)
+
+        if body:
+            body.close()
+            self.cache.store(url, response, hasher.hexdigest(),
+                             data, body_file=body.name)
+
+        return data
+
+    def read_covid_csse(self):
+        '''
+        Fetch data from CSSE at JHU COVID-19 github repo.
+        Always retrieve yesterday CVS as long as CSSE updates it on a daily basis
+        Returns a dictionary with data
+        '''
+
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+
+        data = self.fetch('https://github.com/CSSEGISandData/COVID-19/raw/master/csse_covid_19_data/csse_covid_19_daily_reports/{0}.csv'.format(
+            yesterday.strftime('%m-%d-%Y')), self.parse_covid_csse, timeout=40, encoding='utf-8-sig', stream=True)
+
+        if data is None:
+            print('! Unable to fetch latest data from CSSE at JHU github repo')
+            return {}
+
+        return data
+
+    def parse_covid_csse(self, lines):
+        '''
+        Parse CSSE at JHU daily report CSV line by line summing up all Admin2/Province rows of a country
+        Returns a dictionary with data
+        '''
+
+        return parse_csse_report(lines, provinces=self.config.provinces, resolver=self.resolver)
+
+    def read_manual_data(self, url=None):
+        '''
+        Fetch manual populated data from a Google Spreadsheet (manual data source of the configuration by default)
+        Return a dictionary with data
+        '''
+        data = {}
+        url = url or self.config.manual_url
+
+        if not url:
+            print('! No manual data source provided')
+            return data
+
+        data = self.fetch(url, self.parse_manual_data,
+                          timeout=40, encoding='utf-8')
+
+        if data is None:
+            print('! Can not fetch manual data from', url)
+            return {}
+
+        return data
+
+    def parse_manual_data(self, text):
+        '''
+        Parse manual data CSV
+        Return a dictionary with data
+        '''
+        data = {}
+
+        try:
+            csv_reader = csv.reader(StringIO(text), delimiter=',')
+            line = 0
+            for row in csv_reader:
+                if line > 0:
+
+                    obj = self.add_country_data(country_name=row[0], confirmed=row[1], deaths=row[
+                                                2], recovered=row[3], latest_update=row[5], source=row[4])
+
+                    if obj:
+                        data[obj['code']] = obj
+
+                line += 1
+
+        except Exception as e:
+            print('! Error parsing manual data:', e)
+            data = {}
+
+        return data
+
+    def read_arcgis(self):
+        '''
+        Fetch data from CSSE at JHU COVID-19 ArcGIS service.
+        Asks for the number of records and the server page limit (maxRecordCount of the layer) first
+        and then fetches all the pages in parallel merging them as they arrive.
+        The source is dropped if a page is truncated by the server or the number of features differs from the count,
+        so the result is complete for layers of any size
+        Return a dictionary with data
+        '''
+
+        data = {}
+
+        executor = DaemonExecutor(max_workers=ARCGIS_CONCURRENCY)
+
+        try:
+            layer = executor.submit(self.fetch, re.sub(r'/query$', '', ARCGIS_LAYER_URL) + '?f=json',
+                                    self.parse_arcgis_layer, timeout=120)
+
+            count = self.fetch(self.arcgis_query_url(returnCountOnly='true'),
+                               self.parse_arcgis_count, timeout=120)
+
+            if count is None:
+                print('! Unable to fetch latest data from CSSE at JHU ArcGIS')
+                return data
+
+            try:
+                max_records = layer.result()
+            except Exception as e:
+                print('! Unable to fetch CSSE at JHU ArcGIS layer info:', e)
+                max_records = None
+
+            page_size = min(ARCGIS_PAGE_SIZE, max_records or ARCGIS_PAGE_SIZE)
+
+            futures = [executor.submit(self.fetch, self.arcgis_query_url(resultOffset=offset, resultRecordCount=page_size),
+                                       self.parse_arcgis, timeout=120, encoding='utf-8', stream=True, lines=False) for offset in range(0, count, page_size)]
+
+            features = 0
+
+            for future in as_completed(futures):
+                try:
+                    page = future.result()
+                except ValueError as e:
+                    print('! Wrong data format from CSSE at JHU ArcGIS:', e)
+                    return {}
+
+                if page is None:
+                    print('! Unable to fetch latest data from CSSE at JHU ArcGIS')
+                    return {}
+
+                if page['exceeded']:
+                    print('! CSSE at JHU ArcGIS page is truncated by the server record limit')
+                    return {}
+
+                features += page['features']
+                merge_country_data(data, page['data'])
+
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        if features != count:
+            print('! CSSE at JHU ArcGIS returned {0} features of {1}'.format(
+                features, count))
+            return {}
+
+        return data
+
+    def arcgis_query_url(self, **params):
+        '''
+        Build ArcGIS layer query URL requesting only the attributes we use
+        '''
+        query = {
+            'f': 'json',
+            'where': '1=1',
+            'returnGeometry': 'false',
+            'outFields': ','.join(ARCGIS_FIELDS),
+            'orderByFields': 'OBJECTID ASC',
+            'cacheHint': 'true',
+        }
+        query.update(params)
+
+        return ARCGIS_LAYER_URL + '?' + urlencode(query)
+
+    def parse_arcgis_layer(self, text):
+        '''
+        Parse ArcGIS layer info
+        Return maximal number of records per query or None
+        '''
+        try:
+            return int(json.loads(text)['maxRecordCount'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def parse_arcgis_count(self, text):
+        '''
+        Parse ArcGIS returnCountOnly response
+        Return number of records or None
+        '''
+        try:
+            return int(json.loads(text)['count'])
+        except (ValueError, KeyError, TypeError):
+            print('! Wrong count format from CSSE at JHU ArcGIS')
+            return None
+
+    def parse_arcgis(self, chunks):
+        '''
+        Parse a page of CSSE at JHU COVID-19 ArcGIS service JSON response decoding features one by one.
+        Features of the same country (province or county level layers) are summed up
+        Return a dictionary with data, number of features and exceededTransferLimit flag of the page
+        '''
+
+        data = {}
+        envelope = {}
+        features = 0
+
+        for item in iter_json_array(chunks, 'features', envelope):
+            features += 1
+            attributes = item['attributes']
+
+            obj = self.add_country_data(
+                country_name=attributes['Country_Region'], confirmed=attributes['Confirmed'] or 0, deaths=attributes['Deaths'] or 0, recovered=attributes['Recovered'] or 0, latest_update=datetime.fromtimestamp(attributes['Last_Update'] / 1000).strftime("%Y/%m/%d, %H:%M:%S") if attributes['Last_Update'] else '', source='JHU CSSE')
+
+            if obj:
+                merge_country_data(data, {obj['code']: obj})
+
+        return {
+            'data': data,
+            'features': features,
+            'exceeded': bool(envelope.get('exceededTransferLimit')),
+        }
+
+    def read_worldometer(self):
+        '''
+        Fetch data from COVID-19 page on Worldometer website
+        https://www.worldometers.info/coronavirus/
+
+        Return a dictionary with data
+        '''
+
+        data = self.fetch('https://www.worldometers.info/coronavirus/',
+                          self.parse_worldometer, timeout=40)
+
+        if data is None:
+            print('! Unable to fetch latest data from Worldometer')
+            return {}
+
+        return data
+
+    def parse_worldometer(self, text):
+        '''
+        Parse COVID-19 page of Worldometer website with the parser selected by WORLDOMETER_PARSER
+        Return a dictionary with data
+        '''
+
+        if WORLDOMETER_PARSER == 'soup':
+            return self.parse_worldometer_soup(text)
+
+        data = self.parse_worldometer_stream(text)
+
+        if WORLDOMETER_PARSER == 'compare':
+            self.compare_worldometer(data, self.parse_worldometer_soup(text))
+
+        return data
+
+    def parse_worldometer_stream(self, text, chunk_size=65536):
+        '''
+        Parse countries table of Worldometer page incrementally, chunk by chunk,
+        skipping the page content before the table and stopping right after its <tbody>
+        Return a dictionary with data
+        '''
+
+        data = {}
+        latest_update = datetime.now().strftime("%Y/%m/%d, %H:%M:%S")
+
+        parser = WorldometerTableParser()
+
+        # Jump straight to the opening tag of the table
+        start = text.find('main_table_countries_today')
+        start = max(text.rfind('<table', 0, start), 0) if start >= 0 else 0
+
+        for offset in range(start, len(text), chunk_size):
+            parser.feed(text[offset:offset + chunk_size])
+
+            rows, parser.rows = parser.rows, []
+
+            for cells in rows:
+                if len(cells) < 6:
+                    continue
+
+                obj = self.add_country_data(country_name=cells[0].strip(), confirmed=self.parse_num(cells[1]), deaths=self.parse_num(
+                    cells[3]), recovered=self.parse_num(cells[5]), latest_update=latest_update, source='Worldometer')
+
+                if obj:
+                    data[obj['code']] = obj
+
+            if parser.done:
+                break
+
+        if not parser.done:
+            print('! Wrong data format from Worldometer')
+
+        return data
+
+    def parse_worldometer_soup(self, text):
+        '''
+        Parse COVID-19 page of Worldometer website building the whole BeautifulSoup tree
+        Return a dictionary with data
+        '''
+
+        from bs4 import BeautifulSoup
+
+        data = {}
+
+        html = BeautifulSoup(text, "html.parser")
+        table = html.find('table', id='main_table_countries_today')
+
+        for row in table.find('tbody').find_all('tr'):
+            cells = row.find_all('td')
+
+            obj = self.add_country_data(country_name=cells[0].text.strip(), confirmed=self.parse_num(cells[1].text), deaths=self.parse_num(
+                cells[3].text), recovered=self.parse_num(cells[5].text), latest_update=datetime.now().strftime("%Y/%m/%d, %H:%M:%S"), source='Worldometer')
+
+            if obj:
+                data[obj['code']] = obj
+
+        return data
+
+    def compare_worldometer(self, stream_data, soup_data):
+        '''
+        Print the differences between stream and BeautifulSoup parsers results
+        '''
+
+        fields = ('confirmed', 'deaths', 'recovered')
+        diff = 0
+
+        for code in sorted(set(stream_data) | set(soup_data)):
+            stream = stream_data.get(code)
+            soup = soup_data.get(code)
+
+            if not stream or not soup:
+                print('! Worldometer parsers mismatch:', code, 'stream' if soup else 'soup', 'parser is missing it')
+                diff += 1
+            elif any(stream[f] != soup[f] for f in fields):
+                print('! Worldometer parsers mismatch:', code, 'stream', [
+                      stream[f] for f in fields], 'soup', [soup[f] for f in fields])
+                diff += 1
+
+        print('Worldometer parsers comparison:', len(stream_data), 'vs', len(
+            soup_data), 'items,', diff, 'differences')
+
+    def combine_data(self, sources):
+        '''
+        Combines all fetched data sources following MERGE_POLICY:
+        * First priority — ArcGIS data added into covid_data
+        * If a country presents in CSSE git repo — its greater values are used, missing countries are appended
+        * If a country presents in Worldometer and cannot be found in our storage (or country code is among the list: SRB, KGZ, KAZ, RUS, UKR, MZX, UZB) - append it
+        * If a country presents in manually updated dictionary — overwrite the data in storage
+
+        Returns None, merged data is stored in covid_data and contribution of every source in merge_diff
+        '''
+
+        print('\nTotal items in CSSE ArcGIS source:', len(sources.get('arcgis') or {}))
+        print('Total items in CSSE github repo:', len(sources.get('csse') or {}))
+        print('Total items on Worldometer website:', len(sources.get('worldometer') or {}))
+        print('Total items in Manual Data source:', len(sources.get('manual') or {}), '\n')
+
+        records, self.merge_diff = self.merger.merge(
+            {name: data or {} for name, data in sources.items()})
+
+        self.covid_data = {code: record.to_dict()
+                           for code, record in records.items()}
+
+        for name, changes in self.merge_diff.items():
+            print('Countries updated from {0}: {1}'.format(name, len(changes)))
+
+        if MERGE_DIAGNOSTICS:
+            self.print_merge_diff()
+
+        return None
+
+    def print_merge_diff(self):
+        '''
+        Print contribution of every data source into merged data
+        '''
+
+        print("-" * 76 + "|")
+        print("{code:8s} | {source:11s} | {c:15s} | {d:15s} | {r:15s} |".format(
+            code='CODE', source='SOURCE', c='   CONFIRMED', d='    DEATHS', r='  RECOVERED'))
+        print("-" * 76 + "|")
+
+        for name, changes in self.merge_diff.items():
+            for code, metrics in sorted(changes.items()):
+                cells = []
+                for metric in CountryRecord.METRICS:
+                    if metric in metrics:
+                        previous, value = metrics[metric]
+                        cells.append('{0:>6} > {1:<6}'.format(
+                            '+' if previous is None else previous, value))
+                    else:
+                        cells.append('')
+
+                print("{code:8s} | {source:11s} | {0:15s} | {1:15s} | {2:15s} |".format(
+                    *cells, code=code, source=name))
+
+        print("-" * 76 + "|")
+
+    def artifact_meta(self):
+        '''
+        Return _meta block of the published data if METRICS_META is set
+        '''
+        if not METRICS_META:
+            return None
+
+        meta = self.metrics.meta(self.source_rows)
+        meta['stale'] = self.stale_sources
+        meta['quarantined'] = sorted(self.quarantined)
+
+        return meta
+
+    def publish_target(self):
+        '''
+        Return 's3' if S3-type storage is configured, 'redis' otherwise
+        '''
+        return 's3' if AWS_ACCESS_KEY and AWS_SECRET_KEY else 'redis'
+
+    def last_validation(self, target):
+        '''
+        Return validator state saved along with the last snapshot published to the target or None
+        '''
+        state = self.publish_state.load(target) if self.publish_state else None
+
+        return state.get('validation') if state else None
+
+    def last_published(self, target):
+        '''
+        Return (hash, data) of the last snapshot published to the target, (None, None) if unknown
+        '''
+        state = self.publish_state.load(target) if self.publish_state else None
+
+        if state:
+            return state['hash'], state['data']
+
+        return None, None
+
+    def save_to_cloud(self):
+        '''
+        Store our data inside Amazon S3-type Cloud Storage in all the formats (see ARTIFACTS).
+        Upload is skipped if the content hash matches the last published one (kept locally and as map.json metadata),
+        otherwise artifacts are uploaded in parallel with a single public-read PUT each
+        and map.json carrying the new hash goes last
+        '''
+        try:
+            if self.s3 is None:
+                from boto3 import session
+                from botocore.client import Config
+
+                s3session = session.Session()
+                self.s3 = s3session.client('s3',
+                                           region_name=AWS_S3_CUSTOM_DOMAIN,
+                                           endpoint_url=AWS_S3_ENDPOINT_URL,
+                                           aws_access_key_id=AWS_ACCESS_KEY,
+                                           aws_secret_access_key=AWS_SECRET_KEY,
+                                           config=Config(max_pool_connections=S3_UPLOAD_CONCURRENCY))
+
+            client = self.s3
+
+            body, body_hash = serialize_snapshot(self.covid_data, self.artifact_meta())
+            previous_hash, previous = self.last_published('s3')
+
+            if previous_hash is None:
+                try:
+                    head = client.head_object(
+                        Bucket=AWS_STORAGE_BUCKET_NAME, Key=self.config.artifacts['map'][0])
+                    previous_hash = head.get('Metadata', {}).get('content-hash')
+                except Exception:
+                    previous_hash = None
+
+            if previous_hash == body_hash:
+                print('Data is not changed, skipping upload')
+                self.metrics.count('publish_skipped', target='s3')
+                return True
+
+            delta = snapshot_delta(
+                previous, self.covid_data, previous_hash, body_hash, self.stale_sources)
+            print('Countries changed:', len(delta['changed']))
+
+            artifacts = render_artifacts(
+                self.covid_data, body, delta, self.config.artifacts)
+            main_artifact = artifacts.pop(0)
+            main_artifact['metadata'] = {'content-hash': body_hash}
+
+            with ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY) as executor:
+                list(executor.map(self.upload_artifact, artifacts))
+
+            self.upload_artifact(main_artifact)
+
+            print('Uploaded', len(artifacts) + 1, 'objects')
+            self.metrics.count('published_objects', len(artifacts) + 1, target='s3')
+            self.metrics.count('published_bytes', len(main_artifact['body']) + sum(
+                len(artifact['body']) for artifact in artifacts), target='s3')
+
+            if self.publish_state:
+                self.publish_state.save(
+                    's3', body_hash, self.covid_data, self.validator.state())
+
+            return True
+
+        except Exception as e:
+            print('! Upload failed:', e)
+            return False
+
+    def upload_artifact(self, artifact):
+        '''
+        Upload an artifact with a single public-read PUT request
+        '''
+        params = {
+            'Bucket': AWS_STORAGE_BUCKET_NAME,
+            'Key': artifact['key'],
+            'Body': artifact['body'],
+            'ACL': 'public-read',
+            'ContentType': artifact['content_type'],
+            'CacheControl': artifact['cache_control'],
+        }
+
+        if artifact['content_encoding']:
+            params['ContentEncoding'] = artifact['content_encoding']
+
+        if artifact.get('metadata'):
+            params['Metadata'] = artifact['metadata']
+
+        return self.s3.put_object(**params)
+
+    def save_to_redis(self):
+        '''
+        Save the data into Redis storage as a new version:
+        * {prefix}:v{version}:country:{ISO3} — hash with data of a country
+        * {prefix}:v{version}:index:{metric} — sorted set of country codes by the metric
+        * {prefix}:v{version}:meta — hash with content hash, update time and number of countries
+        * {prefix}:current — number of the current version
+        * {prefix} — JSON dump of the whole dataset, {prefix}:delta — changed countries only
+
+        Everything is written in a single MULTI transaction, so the current version switches atomically,
+        then changed codes are published to {prefix}:changes channel and old versions are trimmed
+        (a failed trim does not fail the publish).
+        Skipped if the content hash matches the last published one
+        '''
+        try:
+            if self.redis is None:
+                import redis
+
+                self.redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+                    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS))
+
+            r = self.redis
+            root = self.config.redis_prefix
+
+            body, body_hash = serialize_snapshot(self.covid_data, self.artifact_meta())
+            previous_hash, previous = self.last_published('redis')
+
+            if previous_hash is None:
+                previous_hash = r.get(root + ':hash')
+                previous_hash = previous_hash.decode() if previous_hash else None
+
+            if previous_hash == body_hash:
+                print('Data is not changed, skipping upload')
+                self.metrics.count('publish_skipped', target='redis')
+                return True
+
+            delta = snapshot_delta(
+                previous, self.covid_data, previous_hash, body_hash, self.stale_sources)
+            print('Countries changed:', len(delta['changed']))
+
+            version = r.incr(root + ':version')
+            prefix = '{0}:v{1}'.format(root, version)
+
+            pipe = r.pipeline(transaction=True)
+
+            indexes = {metric: {} for metric in CountryRecord.METRICS}
+            for code, data in self.covid_data.items():
+                country = {field: value for field, value in data.items()
+                           if field != 'provinces'}
+                if 'provinces' in data:
+                    country['provinces'] = json.dumps(
+                        data['provinces'], ensure_ascii=False)
+
+                pipe.hset('{0}:country:{1}'.format(
+                    prefix, code), mapping=country)
+
+                for metric in CountryRecord.METRICS:
+                    indexes[metric][code] = data[metric]
+
+            for metric, index in indexes.items():
+                if index:
+                    pipe.zadd('{0}:index:{1}'.format(prefix, metric), index)
+
+            pipe.hset(prefix + ':meta', mapping={
+                'hash': body_hash,
+                'updated': delta['updated'],
+                'countries': len(self.covid_data),
+                'stale': json.dumps(self.stale_sources),
+            })
+
+            pipe.set(root + ':current', version)
+            pipe.zadd(root + ':versions', {version: time.time()})
+            pipe.set(root, body)
+            pipe.set(root + ':hash', body_hash)
+            pipe.set(root + ':delta',
+                     json.dumps(delta, ensure_ascii=False))
+            pipe.publish(root + ':changes', json.dumps({
+                'version': version,
+                'changed': sorted(delta['changed']),
+                'removed': delta['removed'],
+            }))
+
+            pipe.execute()
+            self.metrics.count('published_objects', len(self.covid_data), target='redis')
+            self.metrics.count('published_bytes', len(body), target='redis')
+
+            if self.publish_state:
+                self.publish_state.save(
+                    'redis', body_hash, self.covid_data, self.validator.state())
+
+            # The new version is live already, failed trim is retried by the next publish
+            try:
+                self.trim_redis_versions()
+            except Exception as e:
+                print('! Unable to trim old Redis versions:', e)
+
+            return True
+
+        except Exception as e:
+            print('! Saving into Redis failed:', e)
+            return False
+
+    def trim_redis_versions(self, retention=REDIS_RETENTION):
+        '''
+        Delete all the versions except the latest ones
+        '''
+        r = self.redis
+        root = self.config.redis_prefix
+        versions = r.zrange(root + ':versions', 0, -retention - 1)
+
+        if not versions:
+            return
+
+        pipe = r.pipeline(transaction=False)
+
+        for version in versions:
+            prefix = '{0}:v{1}'.format(root, version.decode())
+            codes = r.zrange(prefix + ':index:confirmed', 0, -1)
+
+            keys = ['{0}:country:{1}'.format(prefix, code.decode()) for code in codes] + \
+                ['{0}:index:{1}'.format(prefix, metric) for metric in CountryRecord.METRICS] + \
+                [prefix + ':meta']
+
+            pipe.delete(*keys)
+            pipe.zrem(root + ':versions', version)
+
+        pipe.execute()
+
+    def parse_num(self, text=None):
+        '''
+        Format numeric data from Worldometer
+        Return 0 or a valid number
+        '''
+        if type(text) is int:
+            return text
+
+        text = text.strip().replace(',', '')
+        if len(text):
+            try:
+                return int(text)
+            except:
+                return 0
+        return 0
+
+
+class PipelineRunner(object):
+    '''
+    Runs several pipeline configurations in one process.
+    Every upstream source (and every distinct manual data spreadsheet) is fetched and parsed once by a shared factory,
+    the parsed data is passed read-only to the pipelines which select their countries,
+    combine, validate and publish in parallel
+    '''
+
+    def __init__(self, configs, transport=None):
+
+        self.configs = list(configs)
+
+        names = [config.name for config in self.configs]
+        if not names or len(set(names)) != len(names):
+            raise ValueError('Pipeline names should be unique: ' + ', '.join(names))
+
+        self.fetcher = CovidDataFactory(
+            PipelineConfig.union(self.configs), transport)
+        self.pipelines = [CovidDataFactory(config, self.fetcher.http)
+                          for config in self.configs]
+
+    @classmethod
+    def load(cls, path, transport=None):
+        '''
+        Build a runner from a JSON file with a list of PipelineConfig options
+        '''
+        with open(path, encoding='utf-8') as f:
+            return cls([PipelineConfig.from_dict(options) for options in json.load(f)], transport)
+
+    @property
+    def covid_data(self):
+        # The first pipeline is the one served by the API server
+        return self.pipelines[0].covid_data
+
+    @property
+    def history(self):
+        return self.pipelines[0].history
+
+    @property
+    def validated(self):
+        return self.pipelines[0].validated
+
+    def execute(self):
+
+        print('\nFETCH\n')
+
+        fetcher = self.fetcher
+        fetcher.metrics.start()
+        shared = {}
+
+        try:
+            readers = {
+                'arcgis': fetcher.read_arcgis,
+                'worldometer': fetcher.read_worldometer,
+                'csse': fetcher.read_covid_csse,
+            }
+            for config in self.configs:
+                if config.manual_url:
+                    readers['manual ' + config.manual_url] = partial(
+                        fetcher.read_manual_data, config.manual_url)
+
+            shared = fetcher.fetch_sources(readers)
+            fetcher.count_resolved(fetcher.resolver.report_misses())
+        finally:
+            fetcher.metrics.export(any(shared.values()))
+
+        shared = {name: MappingProxyType(data)
+                  for name, data in shared.items()}
+
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=len(self.pipelines)) as executor:
+            futures = {}
+
+            for pipeline in self.pipelines:
+                manual = 'manual ' + (pipeline.config.manual_url or '')
+                sources = MappingProxyType({
+                    'arcgis': shared['arcgis'],
+                    'worldometer': shared['worldometer'],
+                    'csse': shared['csse'],
+                    'manual': shared.get(manual, MappingProxyType({})),
+                })
+                stale = {name: fetched for name, fetched in fetcher.stale_sources.items()
+                         if name in sources}
+                if manual in fetcher.stale_sources:
+                    stale['manual'] = fetcher.stale_sources[manual]
+
+                futures[pipeline.config.name] = executor.submit(
+                    pipeline.execute, sources, stale)
+
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print('! Pipeline {0} failed: {1}'.format(name, e))
+                    results[name] = False
+
+        for name, result in results.items():
+            print('Pipeline {0}: {1}'.format(name, 'OK' if result else 'ERROR'))
+
+        return all(results.values())
+
+
+def csse_columns(header):
+    '''
+    Map CSSE daily report header to column indexes by normalized column names
+    '''
+    columns = {}
+
+    for i, title in enumerate(header):
+        name = CSSE_COLUMNS.get(title.strip().lstrip('\ufeff'))
+        if name and name not in columns:
+            columns[name] = i
+
+    return columns
+
+
+def csse_int(text):
+    '''
+    Parse numeric CSSE value, empty and malformed values are 0
+    '''
+    try:
+        return int(float(text)) if text else 0
+    except ValueError:
+        return 0
+
+
+def iter_text(chunks, encoding='utf-8'):
+    '''
+    Incrementally decode a stream of byte chunks into text chunks
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def iter_text_lines(chunks, encoding='utf-8'):
+    '''
+    Decode a stream of byte chunks and split it into text lines (line endings are kept)
+    '''
+    pending = ''
+
+    for text in iter_text(chunks, encoding):
+        lines = (pending + text).split('\n')
+        pending = lines.pop()
+
+        for line in lines:
+            yield line + '\n'
+
+    if pending:
+        yield pending
+
+
+def iter_json_array(chunks, key, envelope=None):
+    '''
+    Incrementally decode items of a JSON array stored under the key from a stream of text chunks.
+    Only the current item and a chunk of text are kept in memory.
+    If envelope dictionary is given, it is updated with the other keys of the JSON object
+    once the array is read to the end (the rest of the stream is consumed then)
+    '''
+    decoder = json.JSONDecoder()
+    marker = '"{0}"'.format(key)
+    chunks = iter(chunks)
+    buffer = ''
+    prefix = []
+    pos = None
+
+    # Find the beginning of the array
+    for chunk in chunks:
+        buffer += chunk
+        start = buffer.find(marker)
+
+        if start < 0:
+            if envelope is not None:
+                prefix.append(buffer[:-len(marker)])
+            buffer = buffer[-len(marker):]
+            continue
+
+        bracket = buffer.find('[', start + len(marker))
+        if bracket >= 0:
+            pos = bracket + 1
+            if envelope is not None:
+                prefix.append(buffer[:pos])
+            break
+
+    if pos is None:
+        raise ValueError('No "{0}" array found'.format(key))
+
+    while True:
+        # Skip separators, reading more text if needed
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos < len(buffer):
+                break
+
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Unexpected end of "{0}" array'.format(key))
+
+            buffer, pos = buffer[pos:] + chunk, 0
+
+        if buffer[pos] == ']':
+            if envelope is not None:
+                envelope.update(json.loads(
+                    ''.join(prefix) + buffer[pos:] + ''.join(chunks)))
+                envelope.pop(key, None)
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # The item is not complete yet
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise
+
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield item
+        pos = end
+
+
+def merge_country_data(data, page):
+    '''
+    Sum up COVID-19 country data of a page into data keeping the latest update label
+    '''
+    for code, obj in page.items():
+        if code not in data:
+            data[code] = dict(obj)
+            continue
+
+        for metric in ('confirmed', 'deaths', 'recovered'):
+            data[code][metric] += obj[metric]
+
+        if obj['latest_update'] > data[code]['latest_update']:
+            data[code]['latest_update'] = obj['latest_update']
+
+
+def parse_csse_report(lines, provinces=False, source='JHU CSSE', resolver=None):
+    '''
+    Parse CSSE at JHU daily report of any known layout in one pass summing up all the rows of a country.
+    With provinces=True every country keeps Province/State totals under 'provinces' key.
+    Country titles are resolved with RESOLVER unless another resolver is given
+
+    Return a dictionary with data
+    '''
+    data = {}
+
+    csv_reader = csv.reader(lines, delimiter=',')
+    columns = csse_columns(next(csv_reader, []))
+
+    if not {'country', 'confirmed', 'deaths'} <= set(columns):
+        raise ValueError('Unknown CSSE report layout')
+
+    resolver = resolver or RESOLVER
+    resolve = resolver.lookup(source)
+    metrics = [(metric, columns[metric]) for metric in (
+        'confirmed', 'deaths', 'recovered') if metric in columns]
+    country = columns['country']
+    latest_update = columns.get('latest_update')
+    province = columns.get('province') if provinces else None
+
+    for row in csv_reader:
+        if not row:
+            continue
+
+        code = resolve(row[country].strip())
+        if not code:
+            resolver.miss(row[country].strip(), source)
+            continue
+
+        obj = data.get(code)
+        if obj is None:
+            obj = data[code] = {
+                'code': code,
+                'confirmed': 0,
+                'deaths': 0,
+                'recovered': 0,
+                'latest_update': '',
+                'source': source
+            }
+            if province is not None:
+                obj['provinces'] = {}
+
+        values = [(metric, csse_int(row[i])) for metric, i in metrics]
+
+        for metric, value in values:
+            obj[metric] += value
+
+        if latest_update is not None and row[latest_update] > obj['latest_update']:
+            obj['latest_update'] = row[latest_update]
+
+        if province is not None and row[province].strip():
+            totals = obj['provinces'].setdefault(row[province].strip(), {
+                'confirmed': 0, 'deaths': 0, 'recovered': 0})
+            for metric, value in values:
+                totals[metric] += value
+
+    for obj in data.values():
+        obj['latest_update'] = obj['latest_update'].replace('T', ' ')
+
+    return data
+
+
+def csse_report_timestamp(name):
+    '''
+    Return history timestamp of a CSSE at JHU daily report file name (MM-DD-YYYY.csv)
+    '''
+    month, day, year = CSSE_REPORT_NAME.match(os.path.basename(name)).groups()
+    # Reports are published for the whole day, so they go in history at the end of the day
+    return int(datetime(int(year), int(month), int(day), 23, 59, 59,
+                        tzinfo=timezone.utc).timestamp())
+
+
+def read_csse_daily_report(path):
+    '''
+    Parse a CSSE at JHU daily report file of any known layout
+    Used as a process pool worker by backfill_csse()
+
+    Return (timestamp, dictionary with data) or (timestamp, None) if the file can not be parsed
+    '''
+    timestamp = csse_report_timestamp(path)
+
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            data = parse_csse_report(f)
+
+    except (OSError, ValueError, IndexError) as e:
+        print('! Unable to parse CSSE report', path, e)
+        return timestamp, None
+
+    return timestamp, data
+
+
+def backfill_csse(path, since=None, until=None, batch_size=500, workers=None):
+    '''
+    Load CSSE at JHU daily reports from a local checkout of csse_covid_19_daily_reports directory into the history store.
+    Files are parsed in a process pool and appended in batches.
+    As long as the store is append-only, loading reports not newer than the latest stored snapshot is refused
+    '''
+    if not HISTORY_DIR:
+        exit('HISTORY_DIR should be set to backfill the data')
+
+    history = HistoryStore()
+
+    timestamps = history.timestamps()
+    latest = timestamps[-1] if len(timestamps) else None
+
+    reports = []
+    for name in os.listdir(path):
+        match = CSSE_REPORT_NAME.match(name)
+        if not match:
+            continue
+
+        month, day, year = match.groups()
+        date = '{0}-{1}-{2}'.format(year, month, day)
+
+        if (since and date < since) or (until and date > until):
+            continue
+
+        reports.append((date, os.path.join(path, name)))
+
+    reports = [name for date, name in sorted(reports)]
+
+    if reports and latest is not None and csse_report_timestamp(reports[0]) <= latest:
+        exit('History store already has snapshots up to {0}, reports from {1} can not be appended. '
+             'Backfill into an empty HISTORY_DIR or pass --since after the latest snapshot'.format(
+                 datetime.fromtimestamp(int(latest), timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                 os.path.basename(reports[0])))
+
+    print('Backfilling', len(reports), 'CSSE reports from', path)
+
+    started = time.monotonic()
+    loaded = skipped = 0
+    batch = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for timestamp, data in executor.map(read_csse_daily_report, reports, chunksize=16):
+
+            if data is None:
+                skipped += 1
+                continue
+
+            batch.append((timestamp, data))
+
+            if len(batch) >= batch_size:
+                history.append_many(batch)
+                loaded += len(batch)
+                batch = []
+
+    if batch:
+        history.append_many(batch)
+        loaded += len(batch)
+
+    print('Backfilled {0} reports ({1} skipped) in {2:.2f}s'.format(
+        loaded, skipped, time.monotonic() - started))
+
+    return loaded
+
+
+def check_history(path=HISTORY_DIR):
+    '''
+    Print anomalies between consecutive snapshots of the history store
+    Return number of anomalies found
+    '''
+    if not path:
+        print('! HISTORY_DIR is not set')
+        return 0
+
+    anomalies = SnapshotValidator().validate_history(HistoryStore(path))
+
+    for timestamp, code, reasons in anomalies:
+        print('{0} {1}: {2}'.format(datetime.fromtimestamp(
+            timestamp, timezone.utc).strftime("%Y/%m/%d, %H:%M:%S"), code, ', '.join(reasons)))
+
+    print('Found {0} anomalies'.format(len(anomalies)))
+
+    return len(anomalies)
+
+
+def update_covid19_data(event=None, context=None):
+
+    cdf = CovidDataFactory()
+    cdf.execute()
+
+
+def run_covid19_daemon(interval=DAEMON_INTERVAL, jitter=DAEMON_JITTER, factory=None, on_update=None):
+    '''
+    Keep a single process alive and update the data on an internal schedule.
+    HTTP sessions and storage clients stay warm between runs.
+    Runs never overlap: a run which takes longer than the interval delays the next one.
+    on_update is called with merged data after every run which has passed validation (of the served pipeline for PipelineRunner),
+    even if the storage is not available, so the API keeps serving fresh data. Rejected data is never passed to it
+    '''
+
+    cdf = factory or CovidDataFactory()
+
+    while True:
+        started = time.monotonic()
+
+        try:
+            cdf.execute()
+
+            if on_update and cdf.validated:
+                on_update(cdf.covid_data)
+        except (Exception, SystemExit) as e:
+            print('! Update failed:', repr(e))
+
+        delay = interval + random.uniform(-jitter, jitter) - \
+            (time.monotonic() - started)
+
+        print('Next update in {0:.0f}s'.format(max(delay, 0)))
+        time.sleep(max(delay, 0))
+
+
+def run_api_server(host=API_HOST, port=API_PORT, factory=None):
+    '''
+    Serve the latest data over HTTP from memory while updating it on the daemon schedule.
+    Latest snapshot from the history store (if any) is served until the first update is done
+    '''
+
+    import asyncio
+
+    cdf = factory or CovidDataFactory()
+    server = ApiServer(history=cdf.history)
+
+    if cdf.history is not None and len(cdf.history):
+        server.publish(cdf.history.snapshot(len(cdf.history) - 1))
+
+    threading.Thread(target=run_covid19_daemon, kwargs={
+                     'factory': cdf, 'on_update': server.publish}, daemon=True).start()
+
+    asyncio.run(server.serve(host, port))
 
 
 if __name__ == "__main__":
-    update_covid19_data()
+
+    parser = argparse.ArgumentParser(description='COVID-19 Data Factory')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and update the data every DAEMON_INTERVAL seconds')
+    parser.add_argument('--serve', action='store_true',
+                        help='run the daemon and serve the data over HTTP on API_HOST:API_PORT')
+    parser.add_argument('--backfill', metavar='PATH',
+                        help='load CSSE daily reports from a local csse_covid_19_daily_reports directory into HISTORY_DIR')
+    parser.add_argument('--check-history', action='store_true',
+                        help='check every snapshot of HISTORY_DIR store against the preceding one')
+    parser.add_argument('--pipelines', metavar='PATH',
+                        help='JSON file with a list of pipeline configurations sharing a single fetch of every source')
+    parser.add_argument('--since', metavar='YYYY-MM-DD',
+                        help='first report date to backfill')
+    parser.add_argument('--until', metavar='YYYY-MM-DD',
+                        help='last report date to backfill')
+    args = parser.parse_args()
+
+    factory = PipelineRunner.load(args.pipelines) if args.pipelines else None
+
+    if args.backfill:
+        backfill_csse(args.backfill, since=args.since, until=args.until)
+    elif args.check_history:
+        check_history()
+    elif args.serve:
+        run_api_server(factory=factory)
+    elif args.daemon:
+        run_covid19_daemon(factory=factory)
+    elif factory:
+        factory.execute()
+    else:
+        update_covid19_data()
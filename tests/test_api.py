@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+class ApiServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = main.ApiServer()
+        self.server.publish({
+            'USA': {'code': 'USA', 'confirmed': 10, 'deaths': 1, 'recovered': 5,
+                    'latest_update': '2020/03/01, 00:00:00', 'source': 'JHU CSSE'},
+        })
+
+    def exchange(self, request, responses):
+        '''
+        Send raw request bytes over a single connection and return status lines of the responses
+        '''
+        async def run():
+            server = await asyncio.start_server(self.server.handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+
+            async with server:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request)
+
+                statuses = []
+                for _ in range(responses):
+                    status = await reader.readline()
+                    if not status:
+                        break
+
+                    length = 0
+                    while True:
+                        header = await reader.readline()
+                        if header in (b'\r\n', b''):
+                            break
+                        name, _, value = header.decode('latin-1').partition(':')
+                        if name.lower() == 'content-length':
+                            length = int(value)
+
+                    await reader.readexactly(length)
+                    statuses.append(status.decode('latin-1').split()[1])
+
+                writer.close()
+                return statuses
+
+        return asyncio.run(run())
+
+    def test_keep_alive_after_request_body(self):
+        statuses = self.exchange(
+            b'POST /countries HTTP/1.1\r\nHost: localhost\r\nContent-Length: 3\r\n\r\nabc'
+            b'GET /countries/usa HTTP/1.1\r\nHost: localhost\r\n\r\n', 2)
+
+        self.assertEqual(statuses, ['405', '200'])
+
+    def test_chunked_body_closes_connection(self):
+        statuses = self.exchange(
+            b'POST /countries HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n'
+            b'GET /countries/USA HTTP/1.1\r\nHost: localhost\r\n\r\n', 2)
+
+        self.assertEqual(statuses, ['405'])
+
+
+if __name__ == '__main__':
+    unittest.main()
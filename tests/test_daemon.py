@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+
+
+class DaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix='covid-19-test-')
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+
+        state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+        def restore():
+            main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        self.addCleanup(restore)
+
+        main.PUBLISH_STATE_DIR = os.path.join(self.state_dir, 'publish')
+        main.SOURCE_STORE_PATH = ''
+        main.FETCH_CACHE_DIR = ''
+
+        self.fixtures = benchmark.scale_fixtures(benchmark.synthetic_fixtures(), 1)
+
+    def run_daemon(self, factory):
+        updates = []
+
+        # The first sleep between runs ends the daemon loop
+        with mock.patch.object(main.time, 'sleep', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                main.run_covid19_daemon(factory=factory, on_update=updates.append)
+
+        return updates
+
+    def test_update_without_storage(self):
+        factory = main.CovidDataFactory(transport=benchmark.FixtureTransport(self.fixtures))
+
+        # No storage is available: the data is validated but not published
+        with mock.patch.object(factory, 'save_to_redis', return_value=False):
+            updates = self.run_daemon(factory)
+
+        self.assertTrue(factory.validated)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0], factory.covid_data)
+
+    def test_no_update_on_validation_failure(self):
+        factory = main.CovidDataFactory(transport=benchmark.FixtureTransport(self.fixtures))
+
+        with mock.patch.object(factory, 'validate_json', return_value=False):
+            updates = self.run_daemon(factory)
+
+        self.assertFalse(factory.validated)
+        self.assertEqual(updates, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
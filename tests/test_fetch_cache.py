@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+
+
+class ConditionalTransport(benchmark.FixtureTransport):
+    '''
+    Fixture transport answering 304 Not Modified to requests with a matching ETag
+    '''
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+
+        response = super().get(url, headers, timeout, stream)
+        etag = '"{0}"'.format(hashlib.sha1(response.content).hexdigest())
+
+        if (headers or {}).get('If-None-Match') == etag:
+            return self.response(304, b'')
+
+        response.headers['ETag'] = etag
+        return response
+
+
+class FetchCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix='covid-19-test-')
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+
+        state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+        def restore():
+            main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        self.addCleanup(restore)
+
+        main.PUBLISH_STATE_DIR = ''
+        main.SOURCE_STORE_PATH = ''
+        main.FETCH_CACHE_DIR = os.path.join(self.state_dir, 'cache')
+
+        self.transport = ConditionalTransport(
+            benchmark.scale_fixtures(benchmark.synthetic_fixtures(), 1))
+
+    def read_csse(self, **options):
+        factory = main.CovidDataFactory(
+            config=main.PipelineConfig(**options), transport=self.transport)
+        return factory.read_covid_csse()
+
+    def test_parse_options_change_is_a_miss(self):
+        data = self.read_csse(provinces=False)
+        self.assertFalse(any('provinces' in obj for obj in data.values()))
+
+        data = self.read_csse(provinces=True)
+        self.assertTrue(any('provinces' in obj for obj in data.values()))
+
+    def test_entries_keyed_by_parse_options(self):
+        self.read_csse()
+
+        urls = []
+        for name in os.listdir(main.FETCH_CACHE_DIR):
+            if name.endswith('.json'):
+                with open(os.path.join(main.FETCH_CACHE_DIR, name), encoding='utf-8') as f:
+                    urls.append(json.load(f)['url'])
+        self.assertTrue(urls)
+
+        cache = main.FetchCache(main.FETCH_CACHE_DIR, options=main.PipelineConfig().parse_key())
+        self.assertTrue(all(cache.load(url) for url in urls))
+
+        cache = main.FetchCache(main.FETCH_CACHE_DIR, options=main.PipelineConfig(provinces=True).parse_key())
+        self.assertFalse(any(cache.load(url) for url in urls))
+
+
+if __name__ == '__main__':
+    unittest.main()
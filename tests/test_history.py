@@ -0,0 +1,65 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix='covid-19-test-')
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+
+        state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+        def restore():
+            main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        self.addCleanup(restore)
+
+        main.PUBLISH_STATE_DIR = os.path.join(self.state_dir, 'publish')
+        main.SOURCE_STORE_PATH = ''
+        main.FETCH_CACHE_DIR = ''
+
+        self.history_dir = os.path.join(self.state_dir, 'history')
+
+    def test_empty_store_daily(self):
+        history = main.HistoryStore(self.history_dir)
+
+        days, values = history.daily()
+        self.assertEqual(len(days), 0)
+        self.assertEqual(values.shape, (0, history.slots))
+
+        days, deltas = history.daily_deltas()
+        self.assertEqual(len(days), 0)
+
+        days, averages = history.rolling_average()
+        self.assertEqual(len(averages), 0)
+
+    def test_execute_appends_to_fresh_store(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest('fakeredis is not installed')
+
+        fixtures = benchmark.scale_fixtures(benchmark.synthetic_fixtures(), 1)
+        factory = main.CovidDataFactory(
+            config=main.PipelineConfig(history_dir=self.history_dir),
+            transport=benchmark.FixtureTransport(fixtures))
+        factory.redis = fakeredis.FakeRedis()
+
+        self.assertEqual(len(factory.history), 0)
+        self.assertTrue(factory.execute())
+
+        self.assertEqual(len(factory.history), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.history_dir, 'timestamps.bin')))
+        self.assertEqual(set(factory.history.codes), set(factory.covid_data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+
+
+class PipelineRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix='covid-19-test-')
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+
+        state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+        def restore():
+            main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        self.addCleanup(restore)
+
+        main.PUBLISH_STATE_DIR = os.path.join(self.state_dir, 'publish')
+        main.SOURCE_STORE_PATH = ''
+        main.FETCH_CACHE_DIR = ''
+
+        self.transport = benchmark.FixtureTransport(
+            benchmark.scale_fixtures(benchmark.synthetic_fixtures(), 1))
+
+    def test_titles_counted_by_fetcher_only(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest('fakeredis is not installed')
+
+        configs = [main.PipelineConfig(),
+                   main.PipelineConfig.from_dict({'name': 'europe', 'countries': ['DEU', 'FRA', 'ITA', 'ESP', 'GBR']})]
+        runner = main.PipelineRunner(configs, self.transport)
+
+        redis = fakeredis.FakeRedis()
+        for factory in [runner.fetcher] + runner.pipelines:
+            factory.redis = redis
+            factory.metrics = main.RunMetrics(path=self.state_dir, pipeline=factory.config.name)
+
+        self.assertTrue(runner.execute())
+
+        def titles(factory):
+            return {key: value for key, value in factory.metrics.counters.items()
+                    if key[0] in ('titles_resolved', 'titles_unresolved')}
+
+        self.assertTrue(titles(runner.fetcher))
+        for pipeline in runner.pipelines:
+            self.assertEqual(titles(pipeline), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
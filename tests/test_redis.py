@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import main
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class RedisPublishTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp(prefix='covid-19-test-')
+        self.addCleanup(shutil.rmtree, self.state_dir, ignore_errors=True)
+
+        state = main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR
+
+        def restore():
+            main.PUBLISH_STATE_DIR, main.SOURCE_STORE_PATH, main.FETCH_CACHE_DIR = state
+        self.addCleanup(restore)
+
+        main.PUBLISH_STATE_DIR = os.path.join(self.state_dir, 'publish')
+        main.SOURCE_STORE_PATH = ''
+        main.FETCH_CACHE_DIR = ''
+
+        self.factory = main.CovidDataFactory(transport=benchmark.FixtureTransport(
+            benchmark.scale_fixtures(benchmark.synthetic_fixtures(), 1)))
+        self.factory.redis = fakeredis.FakeRedis()
+
+    def test_failed_trim_keeps_publish(self):
+        factory = self.factory
+        root = factory.config.redis_prefix
+
+        with mock.patch.object(factory, 'trim_redis_versions', side_effect=ConnectionError('reset')):
+            self.assertTrue(factory.execute())
+
+        self.assertEqual(int(factory.redis.get(root + ':current')), 1)
+        self.assertIsNotNone(factory.last_published('redis')[0])
+
+        # Same snapshot is not published again as a new version
+        self.assertTrue(factory.execute())
+        self.assertEqual(int(factory.redis.get(root + ':version')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()